@@ -0,0 +1,238 @@
+import argparse
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Table sizes of the Northwind sample database, i.e. scale factor 1
+BASE_CUSTOMERS = 91
+BASE_ORDERS = 830
+SUPPLIERS = 29
+PRODUCTS = 77
+CATEGORIES = [
+    'Beverages', 'Condiments', 'Confections', 'Dairy Products',
+    'Grains/Cereals', 'Meat/Poultry', 'Produce', 'Seafood'
+]
+
+# Customer and supplier addresses, as spelled in the Northwind database
+ADDRESSES = [
+    ('Berlin', 'Germany', None), ('México D.F.', 'Mexico', None), ('London', 'UK', None),
+    ('Luleå', 'Sweden', None), ('Mannheim', 'Germany', None), ('Strasbourg', 'France', None),
+    ('Madrid', 'Spain', None), ('Marseille', 'France', None), ('Tsawassen', 'Canada', 'BC'),
+    ('Buenos Aires', 'Argentina', None), ('Bern', 'Switzerland', None), ('Sao Paulo', 'Brazil', 'SP'),
+    ('Aachen', 'Germany', None), ('Nantes', 'France', None), ('Graz', 'Austria', None),
+    ('Lille', 'France', None), ('Cork', 'Ireland', 'Co. Cork'), ('Seattle', 'USA', 'WA'),
+    ('Portland', 'USA', 'OR'), ('Lyon', 'France', None), ('Reims', 'France', None),
+    ('Stavern', 'Norway', None), ('Caracas', 'Venezuela', 'DF'), ('Rio de Janeiro', 'Brazil', 'RJ'),
+    ('Köln', 'Germany', None), ('Torino', 'Italy', None), ('Lisboa', 'Portugal', None),
+    ('Barcelona', 'Spain', None), ('Århus', 'Denmark', None), ('Helsinki', 'Finland', None),
+    ('Warszawa', 'Poland', None), ('Montréal', 'Canada', 'Québec'), ('San Francisco', 'USA', 'CA')
+]
+
+# Source tables with the columns and types of the Northwind database
+SOURCE_SCHEMA = """
+CREATE TABLE Customers (
+    CustomerID TEXT PRIMARY KEY, CompanyName TEXT, ContactName TEXT, ContactTitle TEXT,
+    Address TEXT, City TEXT, Region TEXT, PostalCode TEXT, Country TEXT, Phone TEXT, Fax TEXT
+);
+CREATE TABLE Orders (
+    OrderID INTEGER PRIMARY KEY, CustomerID TEXT, EmployeeID INTEGER, OrderDate DATETIME,
+    RequiredDate DATETIME, ShippedDate DATETIME, ShipVia INTEGER, Freight NUMERIC,
+    ShipName TEXT, ShipAddress TEXT, ShipCity TEXT, ShipRegion TEXT, ShipPostalCode TEXT,
+    ShipCountry TEXT
+);
+CREATE TABLE "Order Details" (
+    OrderID INTEGER, ProductID INTEGER, UnitPrice NUMERIC, Quantity INTEGER, Discount REAL,
+    PRIMARY KEY (OrderID, ProductID)
+);
+CREATE TABLE Products (
+    ProductID INTEGER PRIMARY KEY, ProductName TEXT, SupplierID INTEGER, CategoryID INTEGER,
+    QuantityPerUnit TEXT, UnitPrice NUMERIC, UnitsInStock INTEGER, UnitsOnOrder INTEGER,
+    ReorderLevel INTEGER, Discontinued TEXT
+);
+CREATE TABLE Categories (
+    CategoryID INTEGER PRIMARY KEY, CategoryName TEXT, Description TEXT, Picture BLOB
+);
+CREATE TABLE Suppliers (
+    SupplierID INTEGER PRIMARY KEY, CompanyName TEXT, ContactName TEXT, ContactTitle TEXT,
+    Address TEXT, City TEXT, Region TEXT, PostalCode TEXT, Country TEXT, Phone TEXT, Fax TEXT,
+    HomePage TEXT
+);
+"""
+
+def skewed_weights(rng, n, exponent=1.1):
+    """Zipf-like selection weights over n members, in random member order.
+    
+    A few members get most of the weight, like the best customers and
+    best-selling products of a real shop.
+    """
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+def customer_ids(n):
+    """Unique five-letter customer IDs, like ALFKI."""
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    digits = np.arange(n)[:, None] // 26 ** np.arange(4, -1, -1) % 26
+    return ["".join(row) for row in letters[digits]]
+
+def generate_customers(rng, n):
+    """Customers spread over the Northwind addresses, a few cities holding most of them."""
+    addresses = rng.choice(len(ADDRESSES), size=n, p=skewed_weights(rng, len(ADDRESSES), 0.8))
+    city, country, region = zip(*(ADDRESSES[i] for i in addresses))
+    ids = customer_ids(n)
+    return pd.DataFrame({
+        'CustomerID': ids,
+        'CompanyName': [f"Company {customer_id}" for customer_id in ids],
+        'ContactName': [f"Contact {customer_id}" for customer_id in ids],
+        'ContactTitle': 'Owner',
+        'Address': [f"{i} Main Street" for i in range(1, n + 1)],
+        'City': city,
+        'Region': region,
+        'PostalCode': [f"{10000 + i}" for i in range(n)],
+        'Country': country,
+        'Phone': '555-0100',
+        'Fax': None
+    })
+
+def generate_catalog(rng):
+    """Categories, suppliers and products of the Northwind catalog's size."""
+    categories = pd.DataFrame({
+        'CategoryID': np.arange(1, len(CATEGORIES) + 1),
+        'CategoryName': CATEGORIES,
+        'Description': [f"{name} description" for name in CATEGORIES],
+        'Picture': None
+    })
+    
+    supplier_addresses = rng.choice(len(ADDRESSES), size=SUPPLIERS)
+    suppliers = pd.DataFrame({
+        'SupplierID': np.arange(1, SUPPLIERS + 1),
+        'CompanyName': [f"Supplier {i}" for i in range(1, SUPPLIERS + 1)],
+        'ContactName': [f"Supplier contact {i}" for i in range(1, SUPPLIERS + 1)],
+        'ContactTitle': 'Sales Manager',
+        'Address': [f"{i} Harbour Road" for i in range(1, SUPPLIERS + 1)],
+        'City': [ADDRESSES[i][0] for i in supplier_addresses],
+        'Region': [ADDRESSES[i][2] for i in supplier_addresses],
+        'PostalCode': [f"{20000 + i}" for i in range(SUPPLIERS)],
+        'Country': [ADDRESSES[i][1] for i in supplier_addresses],
+        'Phone': '555-0200',
+        'Fax': None,
+        'HomePage': None
+    })
+    
+    products = pd.DataFrame({
+        'ProductID': np.arange(1, PRODUCTS + 1),
+        'ProductName': [f"Product {i}" for i in range(1, PRODUCTS + 1)],
+        'SupplierID': rng.integers(1, SUPPLIERS + 1, size=PRODUCTS),
+        'CategoryID': rng.integers(1, len(CATEGORIES) + 1, size=PRODUCTS),
+        'QuantityPerUnit': '10 boxes',
+        'UnitPrice': rng.lognormal(3, 0.8, size=PRODUCTS).round(2),
+        'UnitsInStock': rng.integers(0, 120, size=PRODUCTS),
+        'UnitsOnOrder': rng.integers(0, 60, size=PRODUCTS),
+        'ReorderLevel': rng.integers(0, 30, size=PRODUCTS),
+        'Discontinued': np.where(rng.random(PRODUCTS) < 0.1, '1', '0')
+    })
+    return categories, suppliers, products
+
+def generate_orders(rng, customers, n, start_date, years):
+    """Orders over the date range, growing over time, on weekdays only.
+    
+    Customers are picked with skewed weights, so a few customers place
+    most of the orders. Orders of the last two weeks aren't shipped yet.
+    """
+    start = pd.Timestamp(start_date)
+    business_days = pd.bdate_range(start, start + pd.DateOffset(years=years) - pd.Timedelta(days=1))
+    # Business grows: later days get more orders
+    positions = np.sort(rng.random(n) ** 0.75 * len(business_days)).astype(int)
+    order_dates = business_days[positions]
+    
+    customer_rows = rng.choice(len(customers), size=n, p=skewed_weights(rng, len(customers)))
+    ordering = customers.iloc[customer_rows].reset_index(drop=True)
+    shipped = order_dates + pd.to_timedelta(rng.integers(1, 36, size=n), unit='D')
+    shipped = shipped.where(order_dates < order_dates.max() - pd.Timedelta(days=14))
+    
+    return pd.DataFrame({
+        'OrderID': np.arange(10248, 10248 + n),
+        'CustomerID': ordering['CustomerID'],
+        'EmployeeID': rng.integers(1, 10, size=n),
+        'OrderDate': order_dates.strftime('%Y-%m-%d'),
+        'RequiredDate': (order_dates + pd.Timedelta(days=28)).strftime('%Y-%m-%d'),
+        'ShippedDate': shipped.strftime('%Y-%m-%d'),
+        'ShipVia': rng.integers(1, 4, size=n),
+        'Freight': rng.gamma(1.5, 50, size=n).round(2),
+        'ShipName': ordering['CompanyName'],
+        'ShipAddress': ordering['Address'],
+        'ShipCity': ordering['City'],
+        'ShipRegion': ordering['Region'],
+        'ShipPostalCode': ordering['PostalCode'],
+        'ShipCountry': ordering['Country']
+    })
+
+def generate_order_details(rng, orders, products):
+    """Order lines, about 2.4 per order, with skewed product popularity."""
+    lines_per_order = 1 + rng.poisson(1.6, size=len(orders)).clip(0, 24)
+    order_ids = np.repeat(orders['OrderID'].to_numpy(), lines_per_order)
+    product_rows = rng.choice(len(products), size=len(order_ids), p=skewed_weights(rng, len(products)))
+    
+    details = pd.DataFrame({
+        'OrderID': order_ids,
+        'ProductID': products['ProductID'].to_numpy()[product_rows],
+        'UnitPrice': products['UnitPrice'].to_numpy()[product_rows],
+        'Quantity': rng.integers(1, 4, size=len(order_ids)) * rng.choice([1, 5, 10], size=len(order_ids)),
+        'Discount': rng.choice([0.0, 0.05, 0.1, 0.15, 0.2, 0.25], size=len(order_ids),
+                               p=[0.6, 0.1, 0.1, 0.1, 0.05, 0.05])
+    })
+    # A product appears at most once per order
+    return details.drop_duplicates(['OrderID', 'ProductID'])
+
+def generate_northwind(db_path, scale=1, seed=42, start_date='2020-01-01', years=4):
+    """Write a synthetic Northwind source database at a scale factor.
+    
+    The database has the tables and columns of the Northwind sample with
+    scale times its 830 orders; customers grow with the square root of the
+    scale, the catalog keeps the sample's size. Returns the row count of
+    each table.
+    """
+    rng = np.random.default_rng(seed)
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    db_path.unlink(missing_ok=True)
+    
+    customers = generate_customers(rng, max(1, round(BASE_CUSTOMERS * scale ** 0.5)))
+    categories, suppliers, products = generate_catalog(rng)
+    orders = generate_orders(rng, customers, max(1, round(BASE_ORDERS * scale)), start_date, years)
+    order_details = generate_order_details(rng, orders, products)
+    
+    tables = {
+        'Customers': customers,
+        'Categories': categories,
+        'Suppliers': suppliers,
+        'Products': products,
+        'Orders': orders,
+        'Order Details': order_details
+    }
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SOURCE_SCHEMA)
+        for name, df in tables.items():
+            df.to_sql(name, conn, if_exists='append', index=False, chunksize=50000)
+        conn.commit()
+    finally:
+        conn.close()
+    return {name: len(df) for name, df in tables.items()}
+
+def main():
+    """Generate a synthetic Northwind database from the command line."""
+    parser = argparse.ArgumentParser(description='Generate a synthetic Northwind source database')
+    parser.add_argument('db_path', help='Path of the SQLite database to write')
+    parser.add_argument('--scale', type=float, default=1, help='Scale factor of the order count (1 = 830 orders)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--start-date', default='2020-01-01', help='Date of the first order')
+    parser.add_argument('--years', type=int, default=4, help='Years of order history')
+    args = parser.parse_args()
+    
+    sizes = generate_northwind(args.db_path, args.scale, args.seed, args.start_date, args.years)
+    print(f"Wrote {args.db_path}: {sizes}")
+
+if __name__ == "__main__":
+    main()
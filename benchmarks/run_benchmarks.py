@@ -0,0 +1,226 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+RESULTS_DIR = Path(__file__).parent / "results"
+DEFAULT_CITIES_PATH = ROOT_DIR / "data" / "worldcities.csv"
+
+# Dimension pairs of the Slice & Dice and Pivot Analysis views
+PIVOT_DIMENSIONS = ['Country', 'CategoryName', 'Year', 'SupplierCountry']
+
+def phase_result(seconds, rows, memory_mb):
+    """Timing, throughput and peak memory of one pipeline phase.
+    
+    The peak memory is that used above the memory in use when the phase started.
+    """
+    return {
+        'seconds': round(seconds, 3),
+        'rows': int(rows),
+        'rows_per_second': round(rows / seconds) if seconds else None,
+        'peak_memory_mb': round(memory_mb, 1)
+    }
+
+def benchmark_queries(repeat):
+    """Time the dashboard's aggregate queries against the loaded warehouse.
+    
+    Returns the median time of repeat runs and the row count of each
+    Roll-up & Drill-down level and each pivot.
+    """
+    import sqlite3
+    from config import SQLITE_DB
+    from queries import HIERARCHY_LEVELS, level_query, pivot_query, pivot_matrix, run_query
+    
+    def median_ms(run):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            times.append(time.perf_counter() - start)
+        return {'median_ms': round(statistics.median(times) * 1000, 3), 'rows': len(result)}
+    
+    conn = sqlite3.connect(SQLITE_DB)
+    try:
+        results = {}
+        for dimension, level in HIERARCHY_LEVELS:
+            sql, params = level_query(dimension, level)
+            results[f"{dimension} / {level}"] = median_ms(lambda: run_query(conn, sql, params))
+        for rows, cols in itertools.combinations(PIVOT_DIMENSIONS, 2):
+            sql, params = pivot_query(rows, cols)
+            results[f"Pivot {rows} x {cols}"] = median_ms(
+                lambda: pivot_matrix(run_query(conn, sql, params), rows, cols, 'Average')
+            )
+        return results
+    finally:
+        conn.close()
+
+def run_pipeline(repeat):
+    """Run a full refresh of the ETL on the configured data directory, timing each phase."""
+    from extract import source_table_queries
+    from pipeline import extract_tasks, transform_tasks, load_tasks
+    from load import tables_to_rebuild
+    from utils.task_runner import run_tasks
+    from utils.checkpoint import RunCheckpoint
+    from utils.metrics import watch_memory, end_memory_watch
+    
+    phases = {}
+    checkpoint = RunCheckpoint.create(full_refresh=True)
+    
+    watch = watch_memory()
+    start = time.perf_counter()
+    tasks = extract_tasks()
+    run_tasks(tasks, checkpoint)
+    phases['extract'] = phase_result(
+        time.perf_counter() - start,
+        sum(len(checkpoint[f'extract_{name}']) for name in source_table_queries()),
+        end_memory_watch(watch)
+    )
+    tables = tables_to_rebuild(checkpoint['fingerprints'])
+    
+    watch = watch_memory()
+    start = time.perf_counter()
+    tasks += transform_tasks(tables=tables, fact_dir=checkpoint.path('fact_sales_chunks'))
+    run_tasks(tasks, checkpoint)
+    transform_seconds = time.perf_counter() - start
+    transform_memory_mb = end_memory_watch(watch)
+    
+    watch = watch_memory()
+    start = time.perf_counter()
+    tasks += load_tasks(tables)
+    run_tasks(tasks, checkpoint)
+    load_seconds = time.perf_counter() - start
+    load_memory_mb = end_memory_watch(watch)
+    checkpoint.set_status('complete')
+    
+    # Both phases report the fact rows, only counted once they are loaded
+    fact_rows = checkpoint['load_fact_sales']
+    phases['transform'] = phase_result(transform_seconds, fact_rows, transform_memory_mb)
+    phases['load'] = phase_result(load_seconds, fact_rows, load_memory_mb)
+    
+    return {'phases': phases, 'queries': benchmark_queries(repeat)}
+
+def run_worker(result_file, repeat):
+    """Benchmark the pipeline in this process and write the results as JSON."""
+    sys.path.insert(0, str(ROOT_DIR / "src"))
+    results = run_pipeline(repeat)
+    Path(result_file).write_text(json.dumps(results))
+
+def benchmark_scale(scale, cities_path, repeat, seed, keep_dir=None):
+    """Generate a database at a scale factor and benchmark the pipeline on it.
+    
+    Each scale runs in its own process against its own data directory, so
+    the memory measured is that scale's and the project's data is untouched.
+    """
+    from generate_data import generate_northwind
+    
+    data_dir = Path(keep_dir or tempfile.mkdtemp(prefix=f"northwind-bench-{scale}x-"))
+    try:
+        start = time.perf_counter()
+        sizes = generate_northwind(data_dir / "raw" / "northwind.db", scale, seed)
+        generate_seconds = time.perf_counter() - start
+        print(f"Generated {scale}x database in {generate_seconds:.1f}s: {sizes}")
+        shutil.copy(cities_path, data_dir / "worldcities.csv")
+    
+        result_file = data_dir / "benchmark.json"
+        env = dict(os.environ, NORTHWIND_DATA_DIR=str(data_dir), NORTHWIND_DB_URL="")
+        subprocess.run(
+            [sys.executable, __file__, "--worker", str(result_file), "--repeat", str(repeat)],
+            env=env, check=True
+        )
+        results = json.loads(result_file.read_text())
+        results['source_rows'] = sizes
+        return results
+    finally:
+        if keep_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+def git_revision():
+    """Short hash of the checked out commit, marked dirty if there are uncommitted changes."""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+def compare_results(previous, current):
+    """Print each phase and query time next to a previous run's."""
+    print(f"\nComparison with {previous['revision']} ({previous['timestamp']}):")
+    for scale, result in current['scales'].items():
+        old = previous['scales'].get(scale)
+        if old is None:
+            continue
+        rows = [
+            (f"{phase}", old['phases'][phase]['seconds'], values['seconds'], 's')
+            for phase, values in result['phases'].items() if phase in old['phases']
+        ] + [
+            (name, old['queries'][name]['median_ms'], values['median_ms'], 'ms')
+            for name, values in result['queries'].items() if name in old['queries']
+        ]
+        print(f"\nScale {scale}x:")
+        for name, before, after, unit in rows:
+            change = f"{after / before:.2f}x" if before else "n/a"
+            print(f"  {name:<45} {before:>10.3f}{unit} -> {after:>10.3f}{unit}  ({change})")
+
+def main():
+    """Benchmark the ETL and dashboard queries at several scale factors."""
+    parser = argparse.ArgumentParser(description='Benchmark the Northwind ETL on synthetic data')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 100],
+                        help='Scale factors of the generated databases (1 = 830 orders)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each dashboard query')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed of the generated data')
+    parser.add_argument('--cities', default=str(DEFAULT_CITIES_PATH), help='World cities CSV to use')
+    parser.add_argument('--output', default=str(RESULTS_DIR), help='Directory the results are written to')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    parser.add_argument('--keep-data', help='Keep the generated data of the last scale in this directory')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        run_worker(args.worker, args.repeat)
+        return
+    
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scales': {}
+    }
+    for scale in args.scales:
+        keep_dir = args.keep_data if scale == args.scales[-1] else None
+        results['scales'][f"{scale:g}"] = benchmark_scale(scale, args.cities, args.repeat, args.seed, keep_dir)
+    
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"{datetime.now():%Y%m%d-%H%M%S}-{results['revision']}.json"
+    output_path.write_text(json.dumps(results, indent=2))
+    
+    for scale, result in results['scales'].items():
+        print(f"\nScale {scale}x:")
+        for phase, values in result['phases'].items():
+            print(f"  {phase:<10} {values['seconds']:>8.2f}s  {values['rows_per_second'] or 0:>10,} rows/s"
+                  f"  peak +{values['peak_memory_mb']:,.0f} MB")
+    print(f"\nResults written to {output_path}")
+    
+    if args.compare:
+        compare_results(json.loads(Path(args.compare).read_text()), results)
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,7 @@ import plotly.express as px
 import plotly.graph_objects as go
 from pathlib import Path
 import sys
-import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import logging
 
@@ -31,37 +30,73 @@ try:
         initial_sidebar_state="expanded"
     )
 
-    # Initialize session state
-    if 'last_refresh' not in st.session_state:
-        st.session_state.last_refresh = datetime.now()
-        st.session_state.df = None
-        st.session_state.current_view = 'home'
-        st.session_state.is_loading = False
+    from src.queries import (
+        level_query, pivot_query, pivot_matrix, distinct_values_query, run_query, warehouse_version,
+        JOB_NAMES, job_history_query, step_metrics_query, flag_regressions
+    )
+    from src.utils.connection_pool import get_pool
+    from src.utils.query_cache import QueryCache
+
+    # One read-only connection pool shared by every session of the app
+    @st.cache_resource
+    def connection_pool():
+        return get_pool(SQLITE_DB, read_only=True)
+
+    # Query results shared by every session, kept until the next successful load
+    @st.cache_resource
+    def result_cache():
+        return QueryCache()
+
+    def run(sql, params):
+        with connection_pool().connection() as conn:
+            return run_query(conn, sql, params)
 
-    # Connect to database
-    @st.cache_data(ttl=15)  # Cache data for 15 seconds
-    def load_data():
+    # Queries are pushed down to SQL over the aggregate tables and only the
+    # aggregated rows each chart needs are returned. A query's SQL and
+    # parameters identify the operation, level, dimensions, filters and
+    # aggregation it was built from, so they key its cached result.
+    def query(sql, params=()):
         try:
-            logger.info("Connecting to database...")
-            conn = sqlite3.connect(SQLITE_DB)
-            sales_df = pd.read_sql("""
-                SELECT fs.*, 
-                       dc.CompanyName, dc.Country, dc.City,
-                       dp.ProductName, dp.CategoryName, dp.SupplierCountry
-                FROM fact_sales fs
-                JOIN dim_customer dc ON fs.CustomerID = dc.CustomerID
-                JOIN dim_product dp ON fs.ProductID = dp.ProductID
-            """, conn)
-            conn.close()
-            
-            # Convert OrderDate to datetime
-            sales_df['OrderDate'] = pd.to_datetime(sales_df['OrderDate'])
-            logger.info("Data loaded successfully")
-            return sales_df
+            return result_cache().get_or_run((sql, params), version, lambda: run(sql, params))
         except Exception as e:
             logger.error(f"Error loading data: {str(e)}")
             st.error(f"Error loading data: {str(e)}")
+            st.stop()
+
+    # Pivot matrices with totals, shared by the heatmaps and tables and
+    # cached per rows, columns, aggregation and filters
+    def pivot(rows, cols, agg_func='Sum'):
+        sql, params = pivot_query(rows, cols, **global_filters)
+        try:
+            return result_cache().get_or_run(
+                ('pivot', agg_func, sql, params), version,
+                lambda: pivot_matrix(query(sql, params), rows, cols, agg_func)
+            )
+        except Exception as e:
+            logger.error(f"Error loading data: {str(e)}")
+            st.error(f"Error loading data: {str(e)}")
+            st.stop()
+
+    # Job history changes with every ETL run, so it is read directly; its
+    # queries are indexed and only read the selected period
+    def job_query(sql, params=()):
+        try:
+            with connection_pool().connection() as conn:
+                df = run_query(conn, sql, params)
+        except pd.errors.DatabaseError:
+            # No ETL run has created the job tables yet
             return pd.DataFrame()
+        df['start_time'] = pd.to_datetime(df['start_time'], format='mixed')
+        return df
+
+    # Checked once per rerun: a new successful load invalidates the cached results
+    try:
+        with connection_pool().connection() as conn:
+            version = warehouse_version(conn)
+    except Exception as e:
+        logger.error(f"Error loading data: {str(e)}")
+        st.error(f"Error loading data: {str(e)}")
+        st.stop()
 
     # Title at the top
     st.title("Northwind Data Warehouse Dashboard")
@@ -70,47 +105,28 @@ try:
     st.sidebar.header("OLAP Operations")
     operation = st.sidebar.selectbox(
         "Select OLAP Operation",
-        ["Roll-up & Drill-down", "Slice & Dice", "Pivot Analysis"]
+        ["Roll-up & Drill-down", "Slice & Dice", "Pivot Analysis", "Operational Performance"]
     )
 
-    # Load data with loading state
-    if st.session_state.df is None:
-        with st.spinner('Loading data...'):
-            st.session_state.df = load_data()
-            st.session_state.last_refresh = datetime.now()
-
-    # Check if it's time to refresh data (only if not loading)
-    if not st.session_state.is_loading:
-        current_time = datetime.now()
-        if (current_time - st.session_state.last_refresh).seconds >= 15:
-            st.session_state.is_loading = True
-            with st.spinner('Refreshing data...'):
-                st.session_state.df = load_data()
-                st.session_state.last_refresh = current_time
-            st.session_state.is_loading = False
-
-    # Use the data from session state
-    df = st.session_state.df
+    all_years = query(*distinct_values_query('agg_sales_time', 'Year'))['Year'].tolist()
+    all_countries = query(*distinct_values_query('agg_sales_time', 'Country'))['Country'].tolist()
 
     # Common Filters (Slice operation)
     st.sidebar.header("Global Filters (Slice)")
     selected_years = st.sidebar.multiselect(
         "Select Years",
-        options=sorted(df['OrderDate'].dt.year.unique()),
-        default=sorted(df['OrderDate'].dt.year.unique())[-3:]
+        options=all_years,
+        default=all_years[-3:]
     )
 
     selected_countries = st.sidebar.multiselect(
         "Select Countries",
-        options=sorted(df['Country'].unique()),
-        default=sorted(df['Country'].unique())[:5]
+        options=all_countries,
+        default=all_countries[:5]
     )
 
-    # Apply global filters
-    if selected_years:
-        df = df[df['OrderDate'].dt.year.isin(selected_years)]
-    if selected_countries:
-        df = df[df['Country'].isin(selected_countries)]
+    # Global filters are applied by every query
+    global_filters = {'years': tuple(selected_years), 'countries': tuple(selected_countries)}
 
     # Main Content based on selected operation
     if operation == "Roll-up & Drill-down":
@@ -129,23 +145,8 @@ try:
                 ["Year", "Quarter", "Month", "Day"]
             )
             
-            df['Year'] = df['OrderDate'].dt.year.astype(int)
-            df['Quarter'] = df['OrderDate'].dt.to_period('Q').astype(str)
-            df['Month'] = df['OrderDate'].dt.strftime('%Y-%m')
-            df['Day'] = df['OrderDate'].dt.strftime('%Y-%m-%d')
-            
-            if level == "Year":
-                agg_data = df.groupby('Year')['RevenueEUR'].sum().reset_index()
-                x_col = 'Year'
-            elif level == "Quarter":
-                agg_data = df.groupby('Quarter')['RevenueEUR'].sum().reset_index()
-                x_col = 'Quarter'
-            elif level == "Month":
-                agg_data = df.groupby('Month')['RevenueEUR'].sum().reset_index()
-                x_col = 'Month'
-            else:
-                agg_data = df.groupby('Day')['RevenueEUR'].sum().reset_index()
-                x_col = 'Day'
+            agg_data = query(*level_query("Time", level, **global_filters))
+            x_col = level
             
             # Create the chart with appropriate formatting
             fig = px.bar(agg_data, x=x_col, y='RevenueEUR',
@@ -168,12 +169,8 @@ try:
                 ["Country", "City"]
             )
             
-            if level == "Country":
-                agg_data = df.groupby('Country')['RevenueEUR'].sum().reset_index()
-                x_col = 'Country'
-            else:
-                agg_data = df.groupby(['Country', 'City'])['RevenueEUR'].sum().reset_index()
-                x_col = 'City'
+            agg_data = query(*level_query("Geography", level, **global_filters))
+            x_col = level
             
             agg_data = agg_data.sort_values('RevenueEUR', ascending=True)
             
@@ -201,14 +198,18 @@ try:
             )
             
             if level == "Category":
-                agg_data = df.groupby('CategoryName')['RevenueEUR'].sum().reset_index()
+                agg_data = query(*level_query("Product", level, **global_filters))
                 x_col = 'CategoryName'
             else:
+                categories = query(*distinct_values_query('agg_sales_product', 'CategoryName', **global_filters))
                 selected_category = st.selectbox(
                     "Select Category to View Products",
-                    options=sorted(df['CategoryName'].unique())
+                    options=categories['CategoryName'].tolist()
                 )
-                agg_data = df[df['CategoryName'] == selected_category].groupby('ProductName')['RevenueEUR'].sum().reset_index()
+                agg_data = query(*level_query(
+                    "Product", level, **global_filters,
+                    filters={'CategoryName': selected_category}
+                ))
                 x_col = 'ProductName'
             
             agg_data = agg_data.sort_values('RevenueEUR', ascending=True)
@@ -239,14 +240,8 @@ try:
             )
         
         if dice_dimension1 != dice_dimension2:
-            # Prepare data for selected dimensions
-            if "Year" in [dice_dimension1, dice_dimension2]:
-                df['Year'] = df['OrderDate'].dt.year.astype(int)
-            
-            agg_data = df.groupby([dice_dimension1, dice_dimension2])['RevenueEUR'].sum().reset_index()
-            
-            # Create interactive heatmap
-            pivot_data = agg_data.pivot(index=dice_dimension1, columns=dice_dimension2, values='RevenueEUR')
+            # Heatmap and detail table share one pivot, without its totals
+            pivot_data = pivot(dice_dimension1, dice_dimension2).iloc[:-1, :-1]
             
             fig = px.imshow(pivot_data,
                            labels=dict(x=dice_dimension2, y=dice_dimension1, color="Revenue (EUR)"),
@@ -268,18 +263,13 @@ try:
             # Show detailed data
             st.subheader("Detailed Data View")
             st.dataframe(
-                agg_data.pivot_table(
-                    values='RevenueEUR',
-                    index=dice_dimension1,
-                    columns=dice_dimension2,
-                    aggfunc='sum'
-                ).style.format("€{:,.2f}"),
+                pivot_data.style.format("€{:,.2f}"),
                 use_container_width=True
             )
         else:
             st.warning("Please select different dimensions for analysis")
 
-    else:  # Pivot Analysis
+    elif operation == "Pivot Analysis":
         st.header("Pivot Analysis")
         
         col1, col2, col3 = st.columns(3)
@@ -304,44 +294,11 @@ try:
             )
         
         if rows != cols:
-            # Prepare data
-            if "Year" in [rows, cols]:
-                df['Year'] = df['OrderDate'].dt.year.astype(int)
-            
-            # Create pivot table
-            if agg_func == "Sum":
-                agg_method = 'sum'
-                value_col = 'RevenueEUR'
-                format_str = "€{:,.2f}"
-            elif agg_func == "Average":
-                agg_method = 'mean'
-                value_col = 'RevenueEUR'
-                format_str = "€{:,.2f}"
-            elif agg_func == "Count":
-                agg_method = 'count'
-                value_col = 'OrderID'  # Count orders instead of revenue
-                format_str = "{:,.0f}"  # Integer format for counts
-            elif agg_func == "Min":
-                agg_method = 'min'
-                value_col = 'RevenueEUR'
-                format_str = "€{:,.2f}"
-            else:  # Max
-                agg_method = 'max'
-                value_col = 'RevenueEUR'
-                format_str = "€{:,.2f}"
-            
-            pivot_table = pd.pivot_table(
-                df,
-                values=value_col,
-                index=rows,
-                columns=cols,
-                aggfunc=agg_method,
-                fill_value=0
-            )
+            # Count sales lines instead of revenue for counts
+            format_str = "{:,.0f}" if agg_func == "Count" else "€{:,.2f}"
             
-            # Add totals
-            pivot_table['Total'] = pivot_table.sum(axis=1)
-            pivot_table.loc['Total'] = pivot_table.sum()
+            # Create pivot table, with its totals computed from the same aggregation
+            pivot_table = pivot(rows, cols, agg_func).fillna(0)
             
             # Display pivot table
             st.dataframe(
@@ -370,6 +327,111 @@ try:
         else:
             st.warning("Please select different dimensions for rows and columns")
 
+    else:  # Operational Performance
+        st.header("Operational Performance")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            history_days = st.selectbox(
+                "Select Period",
+                [30, 90, 365, 3650],
+                format_func=lambda days: f"Last {days} days"
+            )
+        with col2:
+            selected_jobs = st.multiselect(
+                "Select Jobs",
+                options=JOB_NAMES,
+                default=JOB_NAMES
+            )
+        
+        since = (datetime.now() - timedelta(days=history_days)).isoformat(sep=' ')
+        runs = job_query(*job_history_query(selected_jobs, since)) if selected_jobs else pd.DataFrame()
+        
+        if runs.empty:
+            st.info("No ETL runs recorded for the selected jobs and period")
+        else:
+            failed_runs = runs[runs['status'] != 'success']
+            runs = flag_regressions(runs[runs['status'] == 'success'], 'duration_seconds', 'job_name')
+            job_regressions = runs[runs['Regression']]
+            
+            # Job durations, with runs slower than their rolling baseline marked
+            fig = px.line(runs, x='start_time', y='duration_seconds', color='job_name',
+                         markers=True, title='Job Duration',
+                         labels={'start_time': 'Run Start', 'duration_seconds': 'Duration (s)', 'job_name': 'Job'})
+            fig.add_scatter(x=job_regressions['start_time'], y=job_regressions['duration_seconds'],
+                            mode='markers', marker=dict(color='red', size=12, symbol='x'), name='Regression')
+            st.plotly_chart(fig, use_container_width=True)
+            
+            if not failed_runs.empty:
+                st.warning(f"{len(failed_runs)} runs in this period did not complete successfully")
+            
+            steps = job_query(*step_metrics_query(selected_jobs, since))
+            if not steps.empty:
+                st.subheader("Step Performance")
+                job_name = st.selectbox(
+                    "Select Job",
+                    options=steps['job_name'].unique().tolist()
+                )
+                job_steps = flag_regressions(steps[steps['job_name'] == job_name], 'wall_seconds', 'step_name')
+                job_steps = job_steps.assign(Throughput=job_steps['rows_out'] / job_steps['wall_seconds'])
+                step_labels = {'start_time': 'Run Start', 'step_name': 'Step'}
+                
+                fig = px.line(job_steps, x='start_time', y='wall_seconds', color='step_name',
+                             markers=True, title=f'Step Timings: {job_name}',
+                             labels={**step_labels, 'wall_seconds': 'Wall Time (s)'})
+                st.plotly_chart(fig, use_container_width=True)
+                
+                # Rows processed and throughput of the steps producing rows
+                row_steps = job_steps.dropna(subset=['rows_out'])
+                if not row_steps.empty:
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        fig = px.line(row_steps, x='start_time', y='rows_out', color='step_name',
+                                     markers=True, title='Rows Processed',
+                                     labels={**step_labels, 'rows_out': 'Rows'})
+                        st.plotly_chart(fig, use_container_width=True)
+                    with col2:
+                        fig = px.line(row_steps, x='start_time', y='Throughput', color='step_name',
+                                     markers=True, title='Throughput',
+                                     labels={**step_labels, 'Throughput': 'Rows/s'})
+                        st.plotly_chart(fig, use_container_width=True)
+                
+                # The latest run's steps against their baselines
+                st.subheader("Latest Run")
+                latest = job_steps[job_steps['job_id'] == job_steps['job_id'].max()]
+                st.dataframe(
+                    latest[[
+                        'step_name', 'calls', 'wall_seconds', 'Baseline', 'cpu_seconds',
+                        'rows_out', 'Throughput', 'peak_memory_mb', 'Regression'
+                    ]].sort_values('wall_seconds', ascending=False).style.format({
+                        'wall_seconds': '{:,.3f}', 'Baseline': '{:,.3f}', 'cpu_seconds': '{:,.3f}',
+                        'rows_out': '{:,.0f}', 'Throughput': '{:,.0f}', 'peak_memory_mb': '{:,.0f}'
+                    }, na_rep=''),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            
+            st.subheader("Regressions")
+            if job_regressions.empty:
+                st.success("No job ran slower than its rolling baseline in this period")
+            else:
+                st.dataframe(
+                    job_regressions[['start_time', 'job_name', 'duration_seconds', 'Baseline']]
+                    .sort_values('start_time', ascending=False)
+                    .style.format({'duration_seconds': '{:,.2f}', 'Baseline': '{:,.2f}'}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+        
+        # Results cached for every session of the dashboard since the last load
+        st.subheader("Query Cache")
+        cache_stats = result_cache().stats()
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Cached Results", f"{cache_stats['entries']:,}")
+        col2.metric("Cache Memory", f"{cache_stats['bytes'] / 2**20:,.1f} MB")
+        col3.metric("Hit Rate", f"{cache_stats['hits'] / lookups:.0%}" if lookups else "n/a")
+
     # Footer
     st.markdown("---")
     st.markdown("Data source: Northwind Database | Last updated: Daily")
@@ -4,8 +4,8 @@ from pathlib import Path
 # Project root directory
 ROOT_DIR = Path(__file__).parent.parent
 
-# Data directories
-DATA_DIR = ROOT_DIR / "data"
+# Data directories (NORTHWIND_DATA_DIR points the pipeline elsewhere, e.g. for benchmarks)
+DATA_DIR = Path(os.environ.get("NORTHWIND_DATA_DIR", ROOT_DIR / "data"))
 RAW_DATA_DIR = DATA_DIR / "raw"
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
 
@@ -18,6 +18,20 @@ PROCESSED_DATA_DIR.mkdir(exist_ok=True)
 SQLITE_DB = DATA_DIR / "northwind_dwh.sqlite"
 DATABASE_URL = f"sqlite:///{SQLITE_DB}"
 
+# Warehouse connection pool shared by the dashboard and job metadata helpers
+CONNECTION_POOL_SIZE = 8
+CONNECTION_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+CONNECTION_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database memory-mapped
+
+# Dashboard query results kept in memory until the next successful load
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# A job or step run counts as a regression on the Operational Performance page
+# when it takes REGRESSION_THRESHOLD times longer than the median of its
+# previous REGRESSION_BASELINE_RUNS successful runs
+REGRESSION_BASELINE_RUNS = 7
+REGRESSION_THRESHOLD = 1.5
+
 # Logging configuration
 LOG_DIR = ROOT_DIR / "logs"
 LOG_DIR.mkdir(exist_ok=True)
@@ -25,18 +39,62 @@ LOG_FILE = LOG_DIR / "etl.log"
 
 # ETL configuration
 BATCH_SIZE = 1000
+LOAD_BATCH_SIZE = 50000  # rows per executemany call when loading the warehouse
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
+FINGERPRINT_CHUNK_SIZE = 50000  # rows hashed at a time when fingerprinting source tables
+FINGERPRINT_RANGE_ORDERS = 1000  # OrderIDs per range when fingerprinting orders and order details
+
+# ETL task graph: independent tasks run concurrently on TASK_WORKERS threads,
+# and a failed task is retried up to TASK_RETRIES times, waiting
+# TASK_RETRY_DELAY seconds before the first retry and twice as long each time
+TASK_WORKERS = 8
+TASK_RETRIES = 3
+TASK_RETRY_DELAY = 5  # seconds
+
+# Order details are split into OrderID ranges of about TRANSFORM_PARTITION_ROWS
+# rows whose facts are built in parallel by up to TRANSFORM_WORKERS processes
+# (NORTHWIND_TRANSFORM_WORKERS); smaller extracts, or a single worker, build
+# them in-process
+TRANSFORM_WORKERS = int(os.environ.get("NORTHWIND_TRANSFORM_WORKERS", os.cpu_count() or 1))
+TRANSFORM_PARTITION_ROWS = 250000
 
-# Data source URLs
-DB_URL = "https://raw.githubusercontent.com/jpwhite3/northwind-SQLite3/main/dist/northwind.db"
+# Task outputs of each ETL run are checkpointed under CHECKPOINT_DIR/<run id>
+# so a failed run can be resumed; the checkpoints of the last
+# CHECKPOINT_KEEP_RUNS runs are kept
+CHECKPOINT_DIR = PROCESSED_DATA_DIR / "checkpoints"
+CHECKPOINT_KEEP_RUNS = 3
+
+# Incremental loads re-extract orders placed within this many days of the
+# last high-water mark so late edits to recent orders are picked up
+INCREMENTAL_LOOKBACK_DAYS = 7
+
+# Data source URLs; an empty NORTHWIND_DB_URL uses the local database as it is
+DB_URL = os.environ.get(
+    "NORTHWIND_DB_URL",
+    "https://raw.githubusercontent.com/jpwhite3/northwind-SQLite3/main/dist/northwind.db"
+)
+DOWNLOAD_TIMEOUT = 30  # seconds to connect or wait for data
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # bytes written at a time
 
 # World cities data
 CITIES_FILENAME = "worldcities.csv"
 CITIES_PATH = DATA_DIR / CITIES_FILENAME
+# Indexed lookup snapshot of the cities data, rebuilt when the CSV changes
+CITIES_SNAPSHOT_PATH = PROCESSED_DATA_DIR / "worldcities.sqlite"
+
+# Customer cities without an exact match are matched to the most similar
+# city name in their country (edit-distance similarity between 0 and 1)
+GEO_MATCH_MIN_SIMILARITY = 0.8
+GEO_MATCH_CANDIDATES = 20  # trigram candidates compared per unmatched city
 
 # Exchange rate API
 EXCHANGE_RATE_API = "https://api.exchangerate-api.com/v4/latest/USD"
+EXCHANGE_RATE_TIMEOUT = 10  # seconds
+
+# Currencies fact_sales revenue is converted to (as Revenue<currency> columns)
+REPORTING_CURRENCIES = ["EUR"]
+FALLBACK_EXCHANGE_RATES = {"EUR": 0.92}  # Used if the API fails
 
 # City name fixes for standardization
 CITY_FIXES = {
@@ -1,22 +1,188 @@
 import os
-import urllib.request
+import time
+import hashlib
+import json
+import base64
 import sqlite3
+import threading
+import numpy as np
 import pandas as pd
 import requests
 from pathlib import Path
+from geo_match import build_match_index, MATCH_INDEX_VERSION
+from schema import compact_dtypes
+from utils.metrics import instrument
 from config import (
-    RAW_DATA_DIR, DB_URL, CITIES_PATH, EXCHANGE_RATE_API
+    RAW_DATA_DIR, DB_URL, DOWNLOAD_TIMEOUT, DOWNLOAD_CHUNK_SIZE, MAX_RETRIES, RETRY_DELAY,
+    CITIES_PATH, CITIES_SNAPSHOT_PATH, EXCHANGE_RATE_API, EXCHANGE_RATE_TIMEOUT,
+    BATCH_SIZE, INCREMENTAL_LOOKBACK_DAYS, REPORTING_CURRENCIES,
+    FALLBACK_EXCHANGE_RATES, SQLITE_DB, FINGERPRINT_CHUNK_SIZE,
+    FINGERPRINT_RANGE_ORDERS,
+    TRANSFORM_PARTITION_ROWS
 )
 
-def download_database():
-    """Download the Northwind database if it doesn't exist locally."""
-    db_path = RAW_DATA_DIR / "northwind.db"
-    if not db_path.exists():
-        print("Downloading Northwind database...")
-        urllib.request.urlretrieve(DB_URL, db_path)
-        print("Download complete.")
+def read_download_state(path):
+    """Read the JSON state recorded next to a download, or an empty dict."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def write_download_state(path, state):
+    """Atomically write the JSON state recorded next to a download."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(state))
+    os.replace(tmp_path, path)
+
+def digest_header_sha256(headers):
+    """Extract the SHA-256 from an RFC 3230 Digest header as a hex string, if any."""
+    for digest in headers.get('Digest', '').split(','):
+        algorithm, _, value = digest.strip().partition('=')
+        if algorithm.lower() == 'sha-256' and value:
+            return base64.b64decode(value).hex()
+    return None
+
+def fetch_database(url, state, part_path, part_state_path):
+    """Make one request for the database, streaming the body into part_path.
+    
+    Sends the validators of the local copy (state) as conditional request
+    headers, and resumes a partial download left by an earlier attempt
+    with a Range request guarded by If-Range; a partial download that is
+    already complete is returned without a request, and one the server
+    can't resume from (416) is discarded and downloaded again. Returns None
+    if the server reports the local copy is current, otherwise the
+    response validators.
+    """
+    headers = {'Accept-Encoding': 'identity'}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    
+    part_state = read_download_state(part_state_path) if part_path.exists() else {}
+    resume_from = part_path.stat().st_size if part_state else 0
+    etag = part_state.get('etag')
+    validator = etag if etag and not etag.startswith('W/') else part_state.get('last_modified')
+    if resume_from and validator:
+        headers['Range'] = f"bytes={resume_from}-"
+        headers['If-Range'] = validator
+    
+    if resume_from and part_state.get('total_size') is not None and resume_from >= part_state['total_size']:
+        # The last attempt received the whole body; it only needs verifying
+        return part_state
+    
+    with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 304:
+            return None
+        if response.status_code == 416 and 'Range' in headers:
+            print("Partial download doesn't match the remote file; starting over...")
+            part_path.unlink(missing_ok=True)
+            part_state_path.unlink(missing_ok=True)
+            return fetch_database(url, state, part_path, part_state_path)
+        response.raise_for_status()
+        
+        resumed = response.status_code == 206
+        if resumed:
+            total_size = int(response.headers['Content-Range'].rpartition('/')[2])
+            print(f"Resuming download at byte {resume_from}...")
+        else:
+            content_length = response.headers.get('Content-Length')
+            total_size = int(content_length) if content_length else None
+            part_state = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': digest_header_sha256(response.headers),
+                'total_size': total_size
+            }
+            write_download_state(part_state_path, part_state)
+        
+        with open(part_path, 'ab' if resumed else 'wb') as f:
+            for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(block)
+    return part_state
+
+def verify_download(part_path, part_state):
+    """Check a completed download and return its SHA-256.
+    
+    Raises ValueError if its size or checksum doesn't match what the server
+    announced, or if it isn't a SQLite database.
+    """
+    size = part_path.stat().st_size
+    if part_state.get('total_size') is not None and size != part_state['total_size']:
+        raise ValueError(f"Downloaded {size} bytes, expected {part_state['total_size']}")
+    with open(part_path, 'rb') as f:
+        if f.read(16) != b"SQLite format 3\x00":
+            raise ValueError("Downloaded file is not a SQLite database")
+    sha256 = file_sha256(part_path)
+    if part_state.get('sha256') and sha256 != part_state['sha256']:
+        raise ValueError("Downloaded file does not match the server's checksum")
+    return sha256
+
+@instrument
+def download_database(url=DB_URL, db_path=None):
+    """Download the Northwind database, or refresh it if the remote copy changed.
+    
+    Uses conditional requests (ETag / If-Modified-Since) against the
+    validators recorded with the local copy, streams the body to a
+    temporary .part file, resumes interrupted transfers with Range requests
+    and verifies the result before atomically replacing the local database.
+    The local file is only replaced when its content actually changed. If
+    the server can't be reached, or no url is configured, the existing
+    local copy is used; without a url or a local copy a ValueError is
+    raised.
+    """
+    db_path = Path(db_path or RAW_DATA_DIR / "northwind.db")
+    if not url:
+        if db_path.exists():
+            return db_path
+        raise ValueError(f"No database URL is configured and there is no local copy at {db_path}")
+    state_path = db_path.with_name(db_path.name + ".json")
+    part_path = db_path.with_name(db_path.name + ".part")
+    part_state_path = part_path.with_name(part_path.name + ".json")
+    state = read_download_state(state_path) if db_path.exists() else {}
+    
+    for attempt in range(1, MAX_RETRIES + 1):
+        size_before = part_path.stat().st_size if part_path.exists() else 0
+        try:
+            part_state = fetch_database(url, state, part_path, part_state_path)
+            break
+        except requests.RequestException as e:
+            # Retry transfers that made progress; they resume where they stopped
+            size_after = part_path.stat().st_size if part_path.exists() else 0
+            if db_path.exists() and size_after <= size_before:
+                print(f"Could not check for a newer database ({e}); using the local copy.")
+                return db_path
+            if attempt == MAX_RETRIES:
+                raise
+            print(f"Download attempt {attempt} failed ({e}); retrying in {RETRY_DELAY}s...")
+            time.sleep(RETRY_DELAY)
+    
+    if part_state is None:
+        part_path.unlink(missing_ok=True)
+        part_state_path.unlink(missing_ok=True)
+        print("Database is up to date.")
+        return db_path
+    
+    try:
+        sha256 = verify_download(part_path, part_state)
+    except ValueError:
+        # Start over next time rather than resuming a corrupt download
+        part_path.unlink(missing_ok=True)
+        part_state_path.unlink(missing_ok=True)
+        raise
+    
+    if db_path.exists() and sha256 == (state.get('sha256') or file_sha256(db_path)):
+        part_path.unlink()
+        print("Database content unchanged.")
     else:
-        print("Database already exists locally.")
+        os.replace(part_path, db_path)
+        print("Download complete.")
+    part_state_path.unlink(missing_ok=True)
+    write_download_state(state_path, {
+        'etag': part_state.get('etag'),
+        'last_modified': part_state.get('last_modified'),
+        'sha256': sha256
+    })
     return db_path
 
 def get_database_connection(db_path):
@@ -25,17 +191,107 @@ def get_database_connection(db_path):
     print("Connected to the Northwind database.")
     return conn
 
-def load_tables(conn):
-    """Load all required tables from the database into pandas DataFrames."""
-    tables = {
-        'customers': pd.read_sql("SELECT * FROM Customers", conn),
-        'orders': pd.read_sql("SELECT * FROM Orders", conn),
-        'order_details': pd.read_sql("SELECT * FROM 'Order Details'", conn),
-        'products': pd.read_sql("SELECT * FROM Products", conn),
-        'categories': pd.read_sql("SELECT * FROM Categories", conn),
-        'suppliers': pd.read_sql("SELECT * FROM Suppliers", conn)
+def orders_filter(high_water_mark=None):
+    """Build the WHERE clause and parameters selecting orders to extract.
+    
+    When a high-water mark from a previous run is given, only orders newer
+    than it are selected, plus the orders placed within the lookback window
+    so late changes to recent orders are picked up, and those in the
+    mark's stale_ranges: OrderID ranges of loaded orders whose source rows
+    changed since (see stale_order_ranges).
+    """
+    if high_water_mark is None:
+        return "", ()
+    where = "WHERE OrderID > ? OR date(OrderDate) >= date(?, ?)"
+    params = (
+        high_water_mark['max_order_id'],
+        high_water_mark['max_order_date'],
+        f"-{INCREMENTAL_LOOKBACK_DAYS} days"
+    )
+    for first, last in high_water_mark.get('stale_ranges', []):
+        where += " OR OrderID BETWEEN ? AND ?"
+        params += (first, last)
+    return where, params
+
+def get_read_only_connection(db_path):
+    """Open a read-only connection to a SQLite database."""
+    return sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+
+# Source database tables fingerprinted to detect changes between runs
+SOURCE_TABLES = {
+    'customers': 'Customers',
+    'orders': 'Orders',
+    'order_details': 'Order Details',
+    'products': 'Products',
+    'categories': 'Categories',
+    'suppliers': 'Suppliers'
+}
+
+# Sources keyed by OrderID, fingerprinted per range of OrderIDs so changes
+# to orders loaded by earlier runs can be found and loaded again
+ORDER_SOURCES = ['orders', 'order_details']
+
+def source_table_queries(high_water_mark=None):
+    """Build the query and parameters extracting each source table.
+    
+    'Order Details' is not included; it is streamed in chunks by
+    iter_order_details so the largest table is never held in memory.
+    """
+    where, params = orders_filter(high_water_mark)
+    return {
+        'customers': ("SELECT * FROM Customers", ()),
+        'orders': (f"SELECT * FROM Orders {where}", params),
+        'products': ("SELECT * FROM Products", ()),
+        'categories': ("SELECT * FROM Categories", ()),
+        'suppliers': ("SELECT * FROM Suppliers", ())
     }
-    return tables
+
+@instrument
+def read_source_table(db_path, query, params=()):
+    """Read one source table on its own read-only connection."""
+    conn = get_read_only_connection(db_path)
+    try:
+        return pd.read_sql(query, conn, params=params)
+    finally:
+        conn.close()
+
+def order_details_filter(high_water_mark=None, order_range=None):
+    """Build the WHERE clause and parameters selecting order details to extract.
+    
+    Selects the details of the orders selected by orders_filter and, given
+    an inclusive (first, last) OrderID range, only those in the range.
+    """
+    where, params = orders_filter(high_water_mark)
+    conditions = [f"OrderID IN (SELECT OrderID FROM Orders {where})"] if where else []
+    if order_range is not None:
+        conditions.append("OrderID BETWEEN ? AND ?")
+        params = (*params, *order_range)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+@instrument
+def iter_order_details(conn, high_water_mark=None, chunksize=BATCH_SIZE, order_range=None):
+    """Yield 'Order Details' rows in chunks of at most chunksize rows.
+    
+    order_range limits them to an inclusive (first, last) OrderID range.
+    """
+    where, params = order_details_filter(high_water_mark, order_range)
+    query = f"SELECT * FROM 'Order Details' {where}"
+    yield from pd.read_sql(query, conn, params=params, chunksize=chunksize)
+
+def order_detail_partitions(conn, high_water_mark=None, partition_rows=TRANSFORM_PARTITION_ROWS):
+    """Split the order details to extract into OrderID ranges of about partition_rows rows.
+    
+    Returns inclusive (first, last) OrderID ranges in ascending order; an
+    order's details are never split across ranges.
+    """
+    where, params = order_details_filter(high_water_mark)
+    counts = pd.read_sql(
+        f"SELECT OrderID, COUNT(*) AS row_count FROM 'Order Details' {where} GROUP BY OrderID ORDER BY OrderID",
+        conn, params=params
+    )
+    partition = (counts['row_count'].cumsum() - 1) // partition_rows
+    bounds = counts.groupby(partition)['OrderID'].agg(['min', 'max'])
+    return [(int(first), int(last)) for first, last in bounds.itertuples(index=False)]
 
 def load_cities_data():
     """Load world cities data from local CSV file."""
@@ -46,13 +302,342 @@ def load_cities_data():
         )
     return pd.read_csv(CITIES_PATH)
 
-def get_exchange_rate():
-    """Get current USD to EUR exchange rate."""
+def file_sha256(path):
+    """Compute the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_snapshot_source(snapshot_path):
+    """Read the source file state a cities snapshot was built from, or None."""
+    if not snapshot_path.exists():
+        return None
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        row = conn.execute(
+            "SELECT mtime_ns, size, sha256, index_version FROM snapshot_source"
+        ).fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+    return dict(zip(['mtime_ns', 'size', 'sha256', 'index_version'], row)) if row else None
+
+def write_snapshot_source(conn, stat, sha256):
+    """Record the source file state a cities snapshot was built from."""
+    conn.execute("DELETE FROM snapshot_source")
+    conn.execute(
+        "INSERT INTO snapshot_source (mtime_ns, size, sha256, index_version) VALUES (?, ?, ?, ?)",
+        (stat.st_mtime_ns, stat.st_size, sha256, MATCH_INDEX_VERSION)
+    )
+
+def build_cities_snapshot(snapshot_path, stat, sha256):
+    """Convert the cities CSV into a SQLite snapshot with the geo-matching index.
+    
+    The snapshot is written to a temporary file and moved into place, so a
+    failed build never leaves a partial snapshot behind.
+    """
+    world_cities = load_cities_data()
+    world_cities.index = pd.RangeIndex(1, len(world_cities) + 1, name='city_id')
+    
+    tmp_path = snapshot_path.with_suffix('.tmp')
+    tmp_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        world_cities.to_sql('cities', conn)
+        conn.execute("CREATE UNIQUE INDEX idx_cities_id ON cities (city_id)")
+        build_match_index(conn, world_cities)
+        conn.execute(
+            "CREATE TABLE snapshot_source (mtime_ns INTEGER, size INTEGER, sha256 TEXT, index_version INTEGER)"
+        )
+        write_snapshot_source(conn, stat, sha256)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, snapshot_path)
+    print(f"Built cities snapshot with {len(world_cities)} cities.")
+
+@instrument
+def get_cities_snapshot(snapshot_path=CITIES_SNAPSHOT_PATH):
+    """Return the cities lookup snapshot, rebuilding it if the CSV changed.
+    
+    An unchanged modification time and size reuse the snapshot directly;
+    otherwise the CSV is hashed and the snapshot is only rebuilt if its
+    content actually changed. Snapshots built with an older matching index
+    are always rebuilt.
+    """
+    if not CITIES_PATH.exists():
+        load_cities_data()  # raises with the usual message
+    
+    stat = CITIES_PATH.stat()
+    source = read_snapshot_source(snapshot_path)
+    if source and source['index_version'] != MATCH_INDEX_VERSION:
+        source = None
+    if source and (source['mtime_ns'], source['size']) == (stat.st_mtime_ns, stat.st_size):
+        return snapshot_path
+    
+    sha256 = file_sha256(CITIES_PATH)
+    if source and source['sha256'] == sha256:
+        conn = sqlite3.connect(snapshot_path)
+        try:
+            write_snapshot_source(conn, stat, sha256)
+            conn.commit()
+        finally:
+            conn.close()
+    else:
+        build_cities_snapshot(snapshot_path, stat, sha256)
+    return snapshot_path
+
+@instrument
+def get_exchange_rates():
+    """Get current USD exchange rates for the reporting currencies."""
     try:
-        response = requests.get(EXCHANGE_RATE_API)
+        response = requests.get(EXCHANGE_RATE_API, timeout=EXCHANGE_RATE_TIMEOUT)
         response.raise_for_status()
         data = response.json()
-        return data['rates']['EUR']
+        return {currency: data['rates'][currency] for currency in REPORTING_CURRENCIES}
     except Exception as e:
-        print(f"Error fetching exchange rate: {e}")
-        return 0.92  # Fallback rate if API fails 
\ No newline at end of file
+        print(f"Error fetching exchange rates: {e}")
+        return dict(FALLBACK_EXCHANGE_RATES)
+
+def read_warehouse(sql, columns, table_name=None):
+    """Read from the warehouse written by previous runs.
+    
+    Returns an empty frame with the given columns when the warehouse or
+    the table doesn't exist yet. Rows read from table_name are converted
+    to the compact dtypes of its schema.
+    """
+    if not SQLITE_DB.exists():
+        return pd.DataFrame(columns=columns)
+    
+    conn = sqlite3.connect(SQLITE_DB)
+    try:
+        df = pd.read_sql(sql, conn)
+    except pd.errors.DatabaseError:
+        # Nothing recorded yet, or a warehouse built before the table existed
+        return pd.DataFrame(columns=columns)
+    finally:
+        conn.close()
+    return compact_dtypes(df, table_name) if table_name else df
+
+@instrument
+def load_exchange_rate_history():
+    """Load the exchange rates recorded by previous runs from the warehouse."""
+    return read_warehouse(
+        "SELECT RateDate, Currency, Rate FROM dim_exchange_rate",
+        ['RateDate', 'Currency', 'Rate'],
+        'dim_exchange_rate'
+    )
+
+@instrument
+def load_dimension_keys():
+    """Load the surrogate keys already assigned in the warehouse.
+    
+    Returns a mapping of dimension name to a Series of surrogate keys
+    indexed by natural key.
+    """
+    customers = read_warehouse(
+        "SELECT CustomerID, CustomerKey FROM dim_customer",
+        ['CustomerID', 'CustomerKey']
+    )
+    products = read_warehouse(
+        "SELECT ProductID, ProductKey FROM dim_product",
+        ['ProductID', 'ProductKey']
+    )
+    return {
+        'dim_customer': customers.set_index('CustomerID')['CustomerKey'].astype('int64'),
+        'dim_product': products.set_index('ProductID')['ProductKey'].astype('int64')
+    }
+
+def hash_frames(frames):
+    """Fingerprint a sequence of DataFrame chunks by row count and content hash."""
+    digest = hashlib.sha256()
+    row_count = 0
+    for df in frames:
+        digest.update(",".join(df.columns).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        row_count += len(df)
+    return {'row_count': row_count, 'content_hash': digest.hexdigest()}
+
+# Fingerprints of the source tables are cached next to the database, for
+# as long as the file is unchanged; tasks fingerprint tables concurrently
+fingerprint_cache_lock = threading.Lock()
+
+def database_file_state(db_path):
+    """Size and modification time of a database file and of its write-ahead log, if any."""
+    db_path = Path(db_path)
+    state = []
+    for path in (db_path, db_path.with_name(db_path.name + "-wal")):
+        if path.exists():
+            stat = path.stat()
+            state += [stat.st_size, stat.st_mtime_ns]
+    return state
+
+def cached_fingerprint(db_path, table_name, file_state):
+    """The fingerprint cached for a source table, or None if its database file changed since."""
+    cache_path = Path(db_path).with_name(Path(db_path).name + ".fingerprints.json")
+    with fingerprint_cache_lock:
+        entry = read_download_state(cache_path).get(table_name)
+    if not entry or entry['file_state'] != file_state:
+        return None
+    fingerprint = entry['fingerprint']
+    if 'ranges' in fingerprint:
+        # JSON turned the range numbers into strings and their values into lists
+        fingerprint['ranges'] = {int(number): tuple(value) for number, value in fingerprint['ranges'].items()}
+    return fingerprint
+
+def cache_fingerprint(db_path, table_name, file_state, fingerprint):
+    """Cache a source table's fingerprint for the state of its database file it was read from."""
+    cache_path = Path(db_path).with_name(Path(db_path).name + ".fingerprints.json")
+    with fingerprint_cache_lock:
+        cache = read_download_state(cache_path)
+        cache[table_name] = {'file_state': file_state, 'fingerprint': fingerprint}
+        write_download_state(cache_path, cache)
+
+@instrument
+def fingerprint_source_table(db_path, table_name):
+    """Fingerprint a source table, streaming it in chunks on its own connection.
+    
+    The fingerprint of an unchanged database file is reused without
+    reading the table.
+    """
+    file_state = database_file_state(db_path)
+    fingerprint = cached_fingerprint(db_path, table_name, file_state)
+    if fingerprint is not None:
+        return fingerprint
+    conn = get_read_only_connection(db_path)
+    try:
+        fingerprint = hash_frames(
+            pd.read_sql(f'SELECT * FROM "{table_name}"', conn, chunksize=FINGERPRINT_CHUNK_SIZE)
+        )
+    finally:
+        conn.close()
+    cache_fingerprint(db_path, table_name, file_state, fingerprint)
+    return fingerprint
+
+# Hash of a NULL in any column
+NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+def row_hashes(df):
+    """Hash each row of a DataFrame by value, whatever dtypes its chunk was read with.
+    
+    Numbers hash alike whether read as integers or floats, and NULLs alike
+    in every column, so a row's hash doesn't depend on the other rows read
+    with it.
+    """
+    hashes = np.zeros(len(df), dtype='uint64')
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            column_hashes = pd.util.hash_array(values.to_numpy(dtype='float64'))
+        else:
+            column_hashes = pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+        column_hashes[values.isna().to_numpy()] = NULL_HASH
+        hashes = hashes * np.uint64(1000003) ^ column_hashes
+    return hashes
+
+def hash_order_ranges(frames, range_size=FINGERPRINT_RANGE_ORDERS):
+    """Fingerprint DataFrame chunks keyed by OrderID per range of range_size OrderIDs.
+    
+    Returns (row_count, content_hash) by range number (OrderID //
+    range_size). A range's hash adds up the hashes of its rows, so it
+    doesn't depend on the order the rows are read in.
+    """
+    totals = {}
+    for df in frames:
+        ranges = pd.Series(row_hashes(df)).groupby((df['OrderID'] // range_size).to_numpy())
+        for number, row_count, total in ranges.agg(['count', 'sum']).itertuples():
+            previous_count, previous_total = totals.get(int(number), (0, 0))
+            totals[int(number)] = (previous_count + int(row_count), (previous_total + int(total)) % 2**64)
+    return {number: (row_count, f"{total:016x}") for number, (row_count, total) in sorted(totals.items())}
+
+@instrument
+def fingerprint_order_table(db_path, table_name, high_water_mark=None):
+    """Fingerprint a source table keyed by OrderID, per range of OrderIDs.
+    
+    Besides its row count and content hash, the fingerprint holds the
+    hashes of every OrderID range under 'ranges' and, given the high-water
+    mark of the last load, those of the ranges as far as the mark under
+    'loaded_ranges', to be compared with the ranges that load recorded.
+    The ranges of an unchanged database file are reused, so only the range
+    holding the mark is read.
+    """
+    file_state = database_file_state(db_path)
+    conn = get_read_only_connection(db_path)
+    try:
+        fingerprint = cached_fingerprint(db_path, table_name, file_state)
+        if fingerprint is None:
+            ranges = hash_order_ranges(
+                pd.read_sql(f'SELECT * FROM "{table_name}"', conn, chunksize=FINGERPRINT_CHUNK_SIZE)
+            )
+            content = json.dumps(sorted(ranges.items())).encode()
+            fingerprint = {
+                'row_count': sum(row_count for row_count, _ in ranges.values()),
+                'content_hash': hashlib.sha256(content).hexdigest(),
+                'ranges': ranges
+            }
+            cache_fingerprint(db_path, table_name, file_state, fingerprint)
+        ranges = fingerprint['ranges']
+        if high_water_mark is not None:
+            # Only the range holding the mark has orders on both sides of it
+            last_loaded = int(high_water_mark['max_order_id'])
+            mark_range = last_loaded // FINGERPRINT_RANGE_ORDERS
+            loaded_ranges = {number: value for number, value in ranges.items() if number < mark_range}
+            loaded_ranges.update(hash_order_ranges(pd.read_sql(
+                f'SELECT * FROM "{table_name}" WHERE OrderID BETWEEN ? AND ?',
+                conn, params=(mark_range * FINGERPRINT_RANGE_ORDERS, last_loaded),
+                chunksize=FINGERPRINT_CHUNK_SIZE
+            )))
+            fingerprint['loaded_ranges'] = loaded_ranges
+        return fingerprint
+    finally:
+        conn.close()
+
+def fingerprint_cities(snapshot_path):
+    """Fingerprint the cities data by the CSV hash recorded in its snapshot."""
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        row_count = conn.execute("SELECT COUNT(*) FROM cities").fetchone()[0]
+    finally:
+        conn.close()
+    return {'row_count': row_count, 'content_hash': read_snapshot_source(snapshot_path)['sha256']}
+
+def fingerprint_exchange_rates(exchange_rates):
+    """Fingerprint the current exchange rates."""
+    content = json.dumps(exchange_rates, sort_keys=True).encode()
+    return {'row_count': len(exchange_rates), 'content_hash': hashlib.sha256(content).hexdigest()}
+
+def changed_sources(fingerprints, previous):
+    """Names of the sources whose fingerprint differs from the previous run's."""
+    def key(fingerprint):
+        return fingerprint and (fingerprint['row_count'], fingerprint['content_hash'])
+    return {name for name, fingerprint in fingerprints.items() if key(previous.get(name)) != key(fingerprint)}
+
+def stale_order_ranges(fingerprints, previous_ranges, range_size=FINGERPRINT_RANGE_ORDERS):
+    """OrderID ranges of loaded orders whose source rows changed since the last load.
+    
+    Compares the ranges of the order sources as far as the high-water mark
+    (their 'loaded_ranges') with the ranges recorded by the last load, by
+    source; every range is stale if the last load recorded none. Returns
+    inclusive (first, last) OrderID ranges, adjacent ranges merged.
+    """
+    stale = set()
+    for name in ORDER_SOURCES:
+        loaded = fingerprints[name].get('loaded_ranges', {})
+        previous = previous_ranges.get(name)
+        if previous is None:
+            stale.update(loaded)
+        else:
+            stale.update(number for number in loaded.keys() | previous.keys()
+                         if loaded.get(number) != previous.get(number))
+    
+    order_ranges = []
+    for number in sorted(stale):
+        first, last = number * range_size, (number + 1) * range_size - 1
+        if order_ranges and order_ranges[-1][1] == first - 1:
+            order_ranges[-1] = (order_ranges[-1][0], last)
+        else:
+            order_ranges.append((first, last))
+    return order_ranges
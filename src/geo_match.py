@@ -0,0 +1,217 @@
+import hashlib
+import json
+import re
+import sqlite3
+import unicodedata
+import pandas as pd
+from config import (
+    CITY_FIXES, COUNTRY_FIXES, CITIES_SNAPSHOT_PATH,
+    GEO_MATCH_MIN_SIMILARITY, GEO_MATCH_CANDIDATES
+)
+from utils.metrics import instrument
+
+# Bumped whenever the index layout below changes, so older snapshots are rebuilt
+MATCH_INDEX_VERSION = 1
+
+def fold_text(value):
+    """Normalize a place name: strip accents, lowercase, drop punctuation."""
+    if not isinstance(value, str):
+        return None
+    value = unicodedata.normalize('NFKD', value)
+    value = "".join(ch for ch in value if not unicodedata.combining(ch)).lower()
+    return " ".join(re.sub(r"[^\w]+", " ", value).split())
+
+def fold_aliases(fixes):
+    """Normalize both sides of an alias table the same way as the names they match."""
+    return {fold_text(alias): fold_text(name) for alias, name in fixes.items()}
+
+CITY_ALIASES = fold_aliases(CITY_FIXES)
+COUNTRY_ALIASES = fold_aliases(COUNTRY_FIXES)
+
+def rules_version():
+    """Fingerprint of the matching rules; cached matches are only reused under the same rules."""
+    rules = [MATCH_INDEX_VERSION, CITY_ALIASES, COUNTRY_ALIASES, GEO_MATCH_MIN_SIMILARITY]
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:16]
+
+def trigrams(name):
+    """Character trigrams of a normalized name, padded so word edges count."""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        previous = current
+    return previous[-1]
+
+def similarity(a, b):
+    """Edit-distance similarity between 0 (different) and 1 (identical)."""
+    longest = max(len(a), len(b))
+    return 1 - edit_distance(a, b) / longest if longest else 1.0
+
+def build_match_index(conn, world_cities):
+    """Build the matching index tables next to the cities table of a snapshot.
+    
+    city_names maps each normalized city name (and ASCII spelling) within a
+    country to its cities, country_codes maps normalized country names and
+    ISO codes to ISO2 codes, and name_trigrams indexes every name by
+    country and trigram for the fuzzy fallback. match_cache holds the
+    matches resolved by previous runs.
+    """
+    cities = pd.DataFrame({
+        'city_id': world_cities.index,
+        'iso2': world_cities['iso2'].str.upper()
+    }, index=world_cities.index)
+    names = pd.concat([
+        cities.assign(name_norm=world_cities['city'].map(fold_text)),
+        cities.assign(name_norm=world_cities['city_ascii'].map(fold_text))
+    ]).dropna().drop_duplicates()
+    names.to_sql('city_names', conn, index=False)
+    conn.execute("CREATE INDEX idx_city_names ON city_names (name_norm, iso2)")
+    
+    countries = pd.concat([
+        pd.DataFrame({'country_norm': world_cities[col].map(fold_text), 'iso2': cities['iso2']})
+        for col in ['country', 'iso2', 'iso3']
+    ]).dropna().drop_duplicates('country_norm')
+    countries.to_sql('country_codes', conn, index=False)
+    conn.execute("CREATE UNIQUE INDEX idx_country_codes ON country_codes (country_norm)")
+    
+    grams = names[['iso2', 'name_norm']].drop_duplicates()
+    grams = grams.assign(trigram=grams['name_norm'].map(trigrams)).explode('trigram')
+    grams.to_sql('name_trigrams', conn, index=False)
+    conn.execute("CREATE INDEX idx_name_trigrams ON name_trigrams (iso2, trigram, name_norm)")
+    
+    conn.execute("""
+    CREATE TABLE match_cache (
+        City TEXT NOT NULL,
+        Country TEXT NOT NULL,
+        rules_version TEXT NOT NULL,
+        city_id INTEGER,
+        method TEXT NOT NULL,
+        score REAL,
+        PRIMARY KEY (City, Country, rules_version)
+    )
+    """)
+
+def find_city(conn, name_norm, iso2):
+    """Return the id of the most populous city with a name in a country, or None."""
+    row = conn.execute("""
+    SELECT c.city_id FROM city_names n JOIN cities c ON c.city_id = n.city_id
+    WHERE n.name_norm = ? AND n.iso2 = ?
+    ORDER BY c.population IS NULL, c.population DESC, c.city_id
+    LIMIT 1
+    """, (name_norm, iso2)).fetchone()
+    return row[0] if row else None
+
+def fuzzy_candidates(conn, name_norm, iso2):
+    """Names in a country sharing the most trigrams with a name."""
+    grams = sorted(trigrams(name_norm))
+    rows = conn.execute(f"""
+    SELECT name_norm FROM name_trigrams
+    WHERE iso2 = ? AND trigram IN ({', '.join('?' for _ in grams)})
+    GROUP BY name_norm
+    ORDER BY COUNT(*) DESC
+    LIMIT ?
+    """, (iso2, *grams, GEO_MATCH_CANDIDATES)).fetchall()
+    return [row[0] for row in rows]
+
+def resolve_address(conn, city, country):
+    """Resolve one (city, country) address to (city id, method, score).
+    
+    The country is resolved through its name or ISO code, then the city by
+    exact normalized name within that country, falling back to the closest
+    trigram candidate by edit distance.
+    """
+    country_norm = fold_text(country)
+    country_norm = COUNTRY_ALIASES.get(country_norm, country_norm)
+    row = conn.execute(
+        "SELECT iso2 FROM country_codes WHERE country_norm = ?", (country_norm,)
+    ).fetchone()
+    if row is None:
+        return None, 'unmatched', None
+    iso2 = row[0]
+    
+    city_norm = fold_text(city)
+    city_norm = CITY_ALIASES.get(city_norm, city_norm)
+    if not city_norm:
+        return None, 'unmatched', None
+    
+    city_id = find_city(conn, city_norm, iso2)
+    if city_id is not None:
+        return city_id, 'exact', 1.0
+    
+    scored = [(similarity(city_norm, name), name) for name in fuzzy_candidates(conn, city_norm, iso2)]
+    if scored:
+        score, name = max(scored)
+        if score >= GEO_MATCH_MIN_SIMILARITY:
+            return find_city(conn, name, iso2), 'fuzzy', score
+    return None, 'unmatched', None
+
+@instrument
+def match_cities(customers, snapshot_path=CITIES_SNAPSHOT_PATH):
+    """Match customer addresses to world cities.
+    
+    Returns one row per distinct (City, Country) of the customers with the
+    matched city's admin_name, lat, lng and population (NULL if unmatched)
+    and how it was matched. Matches are cached in the snapshot, so only new
+    or changed addresses are resolved.
+    """
+    addresses = customers[['City', 'Country']].drop_duplicates()
+    resolvable = addresses.dropna()
+    version = rules_version()
+    
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        cached = pd.read_sql(
+            "SELECT City, Country, city_id, method, score FROM match_cache WHERE rules_version = ?",
+            conn, params=(version,)
+        )
+        known = set(cached[['City', 'Country']].itertuples(index=False, name=None))
+        new_matches = [
+            (city, country, version, *resolve_address(conn, city, country))
+            for city, country in resolvable.itertuples(index=False, name=None)
+            if (city, country) not in known
+        ]
+        if new_matches:
+            conn.executemany(
+                "INSERT OR REPLACE INTO match_cache VALUES (?, ?, ?, ?, ?, ?)", new_matches
+            )
+            conn.commit()
+            matched = sum(1 for match in new_matches if match[3] is not None)
+            print(f"Resolved {len(new_matches)} new customer addresses ({matched} matched).")
+    
+        matches = pd.concat([
+            cached,
+            pd.DataFrame(
+                [match[:2] + match[3:] for match in new_matches],
+                columns=['City', 'Country', 'city_id', 'method', 'score']
+            )
+        ])
+        matches = addresses.merge(matches, on=['City', 'Country'], how='left')
+    
+        # Read only the matched cities
+        conn.execute("CREATE TEMP TABLE matched (city_id INTEGER PRIMARY KEY)")
+        conn.executemany(
+            "INSERT INTO matched VALUES (?)",
+            [(int(city_id),) for city_id in matches['city_id'].dropna().unique()]
+        )
+        city_rows = pd.read_sql(
+            "SELECT c.city_id, c.admin_name, c.lat, c.lng, c.population "
+            "FROM matched m JOIN cities c ON c.city_id = m.city_id",
+            conn
+        )
+    finally:
+        conn.close()
+    
+    matches['method'] = matches['method'].fillna('unmatched')
+    matches['city_id'] = matches['city_id'].astype('float64')
+    city_rows['city_id'] = city_rows['city_id'].astype('float64')
+    return matches.merge(city_rows, on='city_id', how='left')
@@ -1,29 +1,466 @@
 import sqlite3
+import time
 import pandas as pd
-from config import SQLITE_DB
+from config import SQLITE_DB, LOAD_BATCH_SIZE
+from schema import WAREHOUSE_SCHEMA
+from utils.metrics import instrument, step
 from loguru import logger
 
-def load_table(df, table_name, conn):
-    """Load a DataFrame into the data warehouse."""
-    df.to_sql(table_name, conn, if_exists="replace", index=False)
-    logger.info(f"Loaded {table_name} into data warehouse.")
+# Columns identifying the rows an incremental run replaces in each table.
+# fact_sales is replaced per order so removed order lines disappear too.
+UPSERT_KEYS = {
+    'fact_sales': ['OrderID'],
+    'dim_customer': ['CustomerID'],
+    'dim_product': ['ProductID'],
+    'dim_date': ['DateKey'],
+    'dim_exchange_rate': ['RateDate', 'Currency']
+}
+
+# Warehouse tables built from each source input, so a run only rebuilds
+# the tables whose sources changed since the last load
+SOURCE_DEPENDENCIES = {
+    'customers': ['dim_customer'],
+    'world_cities': ['dim_customer'],
+    'products': ['dim_product'],
+    'categories': ['dim_product'],
+    'suppliers': ['dim_product'],
+    'orders': ['fact_sales', 'dim_date'],
+    'order_details': ['fact_sales'],
+    'exchange_rates': ['dim_exchange_rate']
+}
+
+# Warehouse tables the aggregate tables are computed from
+AGGREGATE_SOURCES = ['fact_sales', 'dim_customer', 'dim_product', 'dim_date']
+
+# Connection settings applied while bulk loading. WAL with synchronous=NORMAL
+# only syncs at checkpoints, which is safe against application crashes.
+LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -200000,  # ~200 MB
+    'temp_store': 'MEMORY'
+}
+
+# Pre-aggregated cube tables materialized at load time for the dashboard.
+# Each rolls fact_sales up to the finest level of one hierarchy (or the
+# dimension pairs used by Slice & Dice and Pivot Analysis), always keeping
+# Year and Country so the dashboard's global filters can be applied.
+AGGREGATE_TABLES = {
+    'agg_sales_time': ['Year', 'Quarter', 'Month', 'DateKey', 'Country'],
+    'agg_sales_geography': ['Year', 'Country', 'City'],
+    'agg_sales_product': ['Year', 'Country', 'CategoryName', 'ProductName'],
+    'agg_sales_dimensions': ['Year', 'Country', 'CategoryName', 'SupplierCountry']
+}
+
+AGGREGATE_COLUMNS = {
+    'Year': "dd.Year",
+    'Quarter': "dd.Quarter",
+    'Month': "dd.Month",
+    'DateKey': "dd.DateKey",
+    'Country': "dc.Country",
+    'City': "dc.City",
+    'CategoryName': "dp.CategoryName",
+    'ProductName': "dp.ProductName",
+    'SupplierCountry': "dp.SupplierCountry"
+}
+
+# Sums, counts, minima and maxima roll up further by summing, summing,
+# taking the min and taking the max; averages are RevenueSum / SalesCount
+AGGREGATE_MEASURES = """
+    SUM(fs.RevenueEUR) AS RevenueSum,
+    COUNT(*) AS SalesCount,
+    MIN(fs.RevenueEUR) AS RevenueMin,
+    MAX(fs.RevenueEUR) AS RevenueMax"""
+
+AGGREGATE_MEASURE_COLUMNS = ['RevenueSum', 'SalesCount', 'RevenueMin', 'RevenueMax']
+
+# Secondary indexes, created once tables are published. The fact_sales date
+# index covers the aggregate refresh (a DateKey range scan joined to the
+# dimensions on their keys) and each aggregate table gets an index covering
+# the dashboard's global filters, group-by columns and measures.
+WAREHOUSE_INDEXES = {
+    'fact_sales': {
+        'idx_fact_sales_date': ['DateKey', 'CustomerKey', 'ProductKey', 'RevenueEUR'],
+        'idx_fact_sales_customer': ['CustomerKey'],
+        'idx_fact_sales_product': ['ProductKey']
+    },
+    'dim_customer': {
+        'idx_dim_customer_geography': ['Country', 'City']
+    },
+    'dim_product': {
+        'idx_dim_product_category': ['CategoryName', 'ProductName']
+    },
+    **{
+        name: {f'idx_{name}': columns + AGGREGATE_MEASURE_COLUMNS}
+        for name, columns in AGGREGATE_TABLES.items()
+    }
+}
+
+def apply_load_pragmas(conn):
+    """Tune a warehouse connection for bulk loading."""
+    for pragma, value in LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+def table_exists(conn, table_name):
+    """Check whether a table exists in the data warehouse."""
+    cursor = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table_name,)
+    )
+    return cursor.fetchone() is not None
+
+def table_columns(conn, table_name):
+    """Return the names of a table's columns."""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+def warehouse_schema_is_current():
+    """Check whether the warehouse has every table and column of WAREHOUSE_SCHEMA
+    and AGGREGATE_TABLES.
+    
+    A warehouse built by an older version has to be rebuilt by a full
+    refresh before it can be loaded incrementally.
+    """
+    if not SQLITE_DB.exists():
+        return False
+    conn = sqlite3.connect(SQLITE_DB)
+    try:
+        expected = {
+            **{table_name: list(schema['columns']) for table_name, schema in WAREHOUSE_SCHEMA.items()},
+            **{name: columns + AGGREGATE_MEASURE_COLUMNS for name, columns in AGGREGATE_TABLES.items()}
+        }
+        return all(
+            set(columns) <= set(table_columns(conn, table_name))
+            for table_name, columns in expected.items()
+        )
+    finally:
+        conn.close()
+
+@instrument
+def create_indexes(conn, table_names=None):
+    """Create the secondary indexes of the given (by default all) warehouse tables."""
+    for table_name in table_names or WAREHOUSE_INDEXES:
+        for index_name, columns in WAREHOUSE_INDEXES.get(table_name, {}).items():
+            column_list = ", ".join(f'"{col}"' for col in columns)
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})'
+            )
+
+def staging_table_name(table_name):
+    """Name of the shadow table a full load builds before publishing."""
+    return f"{table_name}_staging"
+
+def create_table_sql(table_name, target_name=None):
+    """Build the CREATE TABLE statement for a warehouse table."""
+    schema = WAREHOUSE_SCHEMA[table_name]
+    target_name = target_name or table_name
+    definitions = [f'"{col}" {col_type}' for col, col_type in schema['columns'].items()]
+    primary_key = ", ".join(f'"{col}"' for col in schema['primary_key'])
+    definitions.append(f"PRIMARY KEY ({primary_key})")
+    return f'CREATE TABLE IF NOT EXISTS "{target_name}" (\n    ' + ",\n    ".join(definitions) + "\n)"
+
+def to_records(df):
+    """Convert a DataFrame into rows of SQLite-compatible Python values."""
+    df = df.copy()
+    for col in df.select_dtypes(include=['datetime', 'datetimetz']).columns:
+        df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+def write_table_chunks(chunks, table_name, conn, key_columns=None, target_name=None):
+    """Bulk write DataFrame chunks into a warehouse table.
+    
+    Runs inside the caller's transaction. Without key columns the target table
+    (table_name unless target_name is given) is recreated from
+    WAREHOUSE_SCHEMA. With key columns, existing rows sharing keys with the
+    incoming chunks are deleted before the chunks are inserted, so the table
+    is upserted. Rows are buffered and written with executemany in batches
+    of LOAD_BATCH_SIZE.
+    """
+    target_name = target_name or table_name
+    upsert = key_columns is not None and table_exists(conn, target_name)
+    start_time = time.perf_counter()
+    replaced_keys = set()
+    row_count = 0
+    
+    if not upsert:
+        conn.execute(f'DROP TABLE IF EXISTS "{target_name}"')
+        conn.execute(create_table_sql(table_name, target_name))
+    
+    # Only insert columns the warehouse table has; schema columns the
+    # chunks don't provide are left NULL
+    existing = set(table_columns(conn, target_name))
+    columns = [col for col in WAREHOUSE_SCHEMA[table_name]['columns'] if col in existing]
+    column_list = ", ".join(f'"{col}"' for col in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    insert_sql = f'INSERT OR REPLACE INTO "{target_name}" ({column_list}) VALUES ({placeholders})'
+    
+    batch = []
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        
+        if upsert:
+            # Delete keys once per load so an order split across chunks
+            # doesn't delete the rows inserted by an earlier chunk
+            keys = chunk[key_columns].drop_duplicates()
+            new_keys = [key for key in keys.itertuples(index=False, name=None)
+                        if key not in replaced_keys]
+            condition = " AND ".join(f'"{col}" = ?' for col in key_columns)
+            conn.executemany(f'DELETE FROM "{target_name}" WHERE {condition}', new_keys)
+            replaced_keys.update(new_keys)
+        
+        batch.extend(to_records(chunk.reindex(columns=columns)))
+        if len(batch) >= LOAD_BATCH_SIZE:
+            conn.executemany(insert_sql, batch)
+            row_count += len(batch)
+            batch = []
+    
+    if batch:
+        conn.executemany(insert_sql, batch)
+        row_count += len(batch)
+    
+    elapsed = time.perf_counter() - start_time
+    rows_per_second = row_count / elapsed if elapsed > 0 else 0
+    action = "Upserted" if upsert else "Loaded"
+    logger.info(
+        f"{action} {row_count} rows into {target_name} "
+        f"in {elapsed:.2f}s ({rows_per_second:,.0f} rows/s)."
+    )
+    return row_count
+
+def load_table_chunks(chunks, table_name, conn, key_columns=None, target_name=None):
+    """Bulk load DataFrame chunks into a warehouse table in a single transaction."""
+    conn.execute("BEGIN")
+    try:
+        row_count = write_table_chunks(chunks, table_name, conn, key_columns, target_name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row_count
+
+@instrument
+def publish_staging_tables(conn, table_names):
+    """Atomically replace the live warehouse tables with their staging tables.
+    
+    All swaps happen in one transaction, so with WAL enabled readers keep
+    seeing the previous warehouse until the commit and then the complete
+    new one, never a partially loaded mix. Indexes are created after the
+    swap, since index names are not changed by the rename.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name in table_names:
+            conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            conn.execute(f'ALTER TABLE "{staging_table_name(name)}" RENAME TO "{name}"')
+        create_indexes(conn, table_names)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Published {len(table_names)} tables to the data warehouse.")
+
+def load_staging_table(conn, table_name, chunks):
+    """Load DataFrame chunks into a table's staging table, to be published later."""
+    with step(f"load.load {table_name}") as metrics:
+        metrics['rows_out'] = load_table_chunks(
+            chunks, table_name, conn, target_name=staging_table_name(table_name)
+        )
+    return metrics['rows_out']
+
+def build_staging_aggregates(conn, table_names):
+    """Build the aggregate tables into staging tables, from the staged tables.
+    
+    table_names are the warehouse tables loaded into staging; the aggregates
+    read the live tables for the others. Returns the names of the aggregate
+    tables built, none if no aggregate source was staged.
+    """
+    if not any(name in table_names for name in AGGREGATE_SOURCES):
+        return []
+    staging_names = {name: staging_table_name(name) for name in table_names}
+    aggregate_staging_names = {name: staging_table_name(name) for name in AGGREGATE_TABLES}
+    conn.execute("BEGIN")
+    try:
+        build_aggregate_tables(conn, staging_names, aggregate_staging_names)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return list(AGGREGATE_TABLES)
+
+def aggregate_select_sql(aggregate_name, source_names=None, where=""):
+    """Build the query rolling fact_sales up into an aggregate table."""
+    source_names = source_names or {}
+    fact_sales = source_names.get('fact_sales', 'fact_sales')
+    dim_customer = source_names.get('dim_customer', 'dim_customer')
+    dim_product = source_names.get('dim_product', 'dim_product')
+    dim_date = source_names.get('dim_date', 'dim_date')
+    
+    columns = AGGREGATE_TABLES[aggregate_name]
+    select = ",\n    ".join(f"{AGGREGATE_COLUMNS[col]} AS {col}" for col in columns)
+    return f"""
+    SELECT {select},{AGGREGATE_MEASURES}
+    FROM "{fact_sales}" fs
+    JOIN "{dim_date}" dd ON fs.DateKey = dd.DateKey
+    JOIN "{dim_customer}" dc ON fs.CustomerKey = dc.CustomerKey
+    JOIN "{dim_product}" dp ON fs.ProductKey = dp.ProductKey
+    {where}
+    GROUP BY {", ".join(AGGREGATE_COLUMNS[col] for col in columns)}
+    """
+
+@instrument
+def build_aggregate_tables(conn, source_names=None, target_names=None):
+    """Materialize every aggregate table from the fact and dimension tables.
+    
+    Runs inside the caller's transaction; source_names and target_names map
+    logical table names to the physical (e.g. staging) tables to use.
+    """
+    target_names = target_names or {}
+    for aggregate_name in AGGREGATE_TABLES:
+        target_name = target_names.get(aggregate_name, aggregate_name)
+        conn.execute(f'DROP TABLE IF EXISTS "{target_name}"')
+        conn.execute(
+            f'CREATE TABLE "{target_name}" AS {aggregate_select_sql(aggregate_name, source_names)}'
+        )
+    logger.info(f"Built {len(AGGREGATE_TABLES)} aggregate tables.")
+
+@instrument
+def refresh_aggregate_tables(conn, years):
+    """Recompute the aggregate rows of the given years after an incremental load.
+    
+    Runs inside the caller's transaction. Only facts of the affected years
+    are re-aggregated, found by a DateKey range scan of the covering date
+    index, so the cost is independent of total history.
+    """
+    if not all(table_exists(conn, name) for name in AGGREGATE_TABLES):
+        build_aggregate_tables(conn)
+        return
+    if not years:
+        return
+    
+    years = sorted(years)
+    year_list = ", ".join("?" for _ in years)
+    date_ranges = " OR ".join("(fs.DateKey >= ? AND fs.DateKey < ?)" for _ in years)
+    date_params = [bound for year in years for bound in (year * 10000, (year + 1) * 10000)]
+    for aggregate_name in AGGREGATE_TABLES:
+        conn.execute(f'DELETE FROM "{aggregate_name}" WHERE Year IN ({year_list})', years)
+        conn.execute(
+            f'INSERT INTO "{aggregate_name}" '
+            + aggregate_select_sql(aggregate_name, where=f"WHERE {date_ranges}"),
+            date_params
+        )
+    logger.info(f"Refreshed aggregate tables for years {years}.")
+
+def tables_to_rebuild(sources):
+    """Warehouse tables depending on any of the given source inputs."""
+    return {table for source in sources for table in SOURCE_DEPENDENCIES[source]}
+
+def fact_order_years(conn, order_ids):
+    """Years of the facts in the warehouse belonging to the given orders."""
+    order_ids = [int(order_id) for order_id in order_ids]
+    years = set()
+    # Batched to stay well below SQLite's limit on bound parameters
+    for start in range(0, len(order_ids), 500):
+        batch = order_ids[start:start + 500]
+        rows = conn.execute(
+            f'SELECT DISTINCT DateKey / 10000 FROM fact_sales '
+            f'WHERE OrderID IN ({", ".join("?" for _ in batch)})',
+            batch
+        )
+        years.update(year for year, in rows if year is not None)
+    return years
+
+def delete_order_ranges(conn, order_ranges):
+    """Delete the facts of inclusive (first, last) OrderID ranges, returning their years.
+    
+    Runs inside the caller's transaction.
+    """
+    years = set()
+    if not table_exists(conn, 'fact_sales'):
+        return years
+    for first, last in order_ranges:
+        rows = conn.execute(
+            'SELECT DISTINCT DateKey / 10000 FROM fact_sales WHERE OrderID BETWEEN ? AND ?', (first, last)
+        )
+        years.update(year for year, in rows if year is not None)
+        conn.execute('DELETE FROM fact_sales WHERE OrderID BETWEEN ? AND ?', (first, last))
+    return years
+
+def track_order_years(chunks, years, conn=None):
+    """Pass fact chunks through while collecting the order years they contain.
+    
+    Given the warehouse connection, the years of the facts the chunks'
+    orders already have in the warehouse are collected too, before the
+    upsert replaces them: an order whose date changed leaves its old
+    year's aggregates to be refreshed as well.
+    """
+    existing = conn is not None and table_exists(conn, 'fact_sales')
+    for chunk in chunks:
+        years.update(int(year) for year in chunk['OrderDate'].dt.year.dropna().unique())
+        if existing:
+            years.update(fact_order_years(conn, chunk['OrderID'].unique()))
+        yield chunk
 
 def create_data_warehouse():
     """Create the data warehouse database."""
     # Connect to (or create) the DW SQLite database
     dwh_conn = sqlite3.connect(SQLITE_DB)
+    apply_load_pragmas(dwh_conn)
     return dwh_conn
 
-def load_data_warehouse(fact_sales, dimensions):
-    """Load all tables into the data warehouse."""
+@instrument
+def load_data_warehouse(fact_sales, dimensions, incremental=False, tables=None, order_ranges=()):
+    """Load all tables into the data warehouse.
+    
+    fact_sales may be a DataFrame or an iterable of DataFrame chunks, which
+    are written one at a time. A full load builds every table into a staging
+    table and publishes them together with an atomic swap; an incremental
+    load upserts the extracted delta into the live tables in one
+    transaction. The aggregate tables are rebuilt (full) or refreshed for
+    the affected years (incremental) as part of the same publish or
+    transaction, so dashboard readers never see a half-loaded warehouse.
+    
+    tables limits the load to the given warehouse tables (e.g. those whose
+    sources changed); the others are left as they are. An incremental load
+    replaces the facts of the inclusive (first, last) OrderID order_ranges
+    with those in fact_sales, so orders and order lines deleted from the
+    source are removed as well.
+    """
     dwh_conn = create_data_warehouse()
     
-    # Load fact table
-    load_table(fact_sales, "fact_sales", dwh_conn)
+    if isinstance(fact_sales, pd.DataFrame):
+        fact_sales = [fact_sales]
+    
+    warehouse_tables = {'fact_sales': fact_sales}
+    warehouse_tables.update({name: [df] for name, df in dimensions.items()})
+    if tables is not None:
+        warehouse_tables = {name: chunks for name, chunks in warehouse_tables.items() if name in tables}
     
-    # Load dimension tables
-    for name, df in dimensions.items():
-        load_table(df, name, dwh_conn)
+    if incremental:
+        order_years = set()
+        if 'fact_sales' in warehouse_tables:
+            warehouse_tables['fact_sales'] = track_order_years(fact_sales, order_years, dwh_conn)
+        dwh_conn.execute("BEGIN")
+        try:
+            if 'fact_sales' in warehouse_tables:
+                order_years.update(delete_order_ranges(dwh_conn, order_ranges))
+            for name, chunks in warehouse_tables.items():
+                with step(f"load.upsert {name}") as metrics:
+                    metrics['rows_out'] = write_table_chunks(chunks, name, dwh_conn, UPSERT_KEYS[name])
+            if 'dim_customer' in warehouse_tables or 'dim_product' in warehouse_tables:
+                # Changed dimension attributes can move facts of any year
+                build_aggregate_tables(dwh_conn)
+            else:
+                refresh_aggregate_tables(dwh_conn, order_years)
+            create_indexes(dwh_conn)
+            dwh_conn.commit()
+        except Exception:
+            dwh_conn.rollback()
+            raise
+    else:
+        for name, chunks in warehouse_tables.items():
+            load_staging_table(dwh_conn, name, chunks)
+        aggregate_names = build_staging_aggregates(dwh_conn, list(warehouse_tables))
+        publish_staging_tables(dwh_conn, list(warehouse_tables) + aggregate_names)
     
     # Confirm tables are created
     tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", dwh_conn)
@@ -31,21 +468,3 @@ def load_data_warehouse(fact_sales, dimensions):
     logger.info(tables)
     
     return dwh_conn
-
-def add_revenue_eur(conn, exchange_rate):
-    """Add EUR revenue to fact_sales table."""
-    cursor = conn.cursor()
-    
-    # Add EUR revenue column if it doesn't exist
-    cursor.execute("""
-    ALTER TABLE fact_sales ADD COLUMN RevenueEUR REAL
-    """)
-    
-    # Update EUR revenue
-    cursor.execute("""
-    UPDATE fact_sales 
-    SET RevenueEUR = RevenueUSD * ?
-    """, (exchange_rate,))
-    
-    conn.commit()
-    logger.info(f"Added EUR revenue (rate: {exchange_rate})") 
\ No newline at end of file
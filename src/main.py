@@ -1,47 +1,37 @@
-from extract import (
-    download_database,
-    get_database_connection,
-    load_tables,
-    load_cities_data,
-    get_exchange_rate
-)
-from transform import (
-    clean_dataframes,
-    create_dimensions,
-    create_fact_table,
-    enrich_customer_dimension
-)
-from load import load_data_warehouse, add_revenue_eur
+from utils.task_runner import run_tasks
+from utils.checkpoint import RunCheckpoint, prune_checkpoints
+from pipeline import extract_tasks, transform_tasks, load_tasks, DIMENSION_TASKS
+from schema import memory_report
+from load import tables_to_rebuild
 
 def main():
     """Main function to orchestrate the ETL process."""
     print("Starting ETL process...")
+    checkpoint = RunCheckpoint.create(full_refresh=True)
     
     # Extract
     print("\n=== Extraction Phase ===")
-    db_path = download_database()
-    conn = get_database_connection(db_path)
-    tables = load_tables(conn)
-    world_cities = load_cities_data()
-    exchange_rate = get_exchange_rate()
+    tasks = extract_tasks()
+    run_tasks(tasks, checkpoint)
+    tables = tables_to_rebuild(checkpoint['fingerprints'])
+    print(f"Extracted {len(checkpoint['extract_orders'])} orders")
     
     # Transform
     print("\n=== Transformation Phase ===")
-    cleaned_tables = clean_dataframes(tables)
-    dimensions = create_dimensions(cleaned_tables)
-    fact_sales = create_fact_table(cleaned_tables)
-    
-    # Enrich customer dimension with geographic data
-    dimensions['dim_customer'] = enrich_customer_dimension(
-        dimensions['dim_customer'],
-        world_cities
-    )
+    tasks += transform_tasks(tables=tables, fact_dir=checkpoint.path('fact_sales_chunks'))
+    run_tasks(tasks, checkpoint)
+    dimensions = {name: checkpoint[name] for name in DIMENSION_TASKS}
+    for name, usage in memory_report(dimensions).items():
+        print(f"In-memory {name}: {usage}")
     
     # Load
     print("\n=== Loading Phase ===")
-    dwh_conn = load_data_warehouse(fact_sales, dimensions)
-    add_revenue_eur(dwh_conn, exchange_rate)
+    tasks += load_tasks(tables)
+    run_tasks(tasks, checkpoint)
+    print(f"Loaded {checkpoint['publish']} into warehouse")
     
+    checkpoint.set_status('complete')
+    prune_checkpoints()
     print("\nETL process completed successfully!")
 
 if __name__ == "__main__":
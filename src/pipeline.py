@@ -0,0 +1,330 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial
+from loguru import logger
+from extract import (
+    download_database, get_cities_snapshot, get_exchange_rates, load_exchange_rate_history,
+    load_dimension_keys, read_source_table, fingerprint_source_table, fingerprint_order_table,
+    fingerprint_cities, fingerprint_exchange_rates, get_database_connection, get_read_only_connection,
+    iter_order_details, order_detail_partitions, source_table_queries, SOURCE_TABLES, ORDER_SOURCES
+)
+from transform import (
+    CLEANING_POLICIES, clean_dataframe, clean_chunks, merge_cleaning_metrics,
+    create_customer_dimension, create_product_dimension, create_order_date_dimension,
+    create_exchange_rate_dimension, build_fact_lookups, create_fact_table, create_fact_chunks,
+    enrich_customer_dimension
+)
+from geo_match import match_cities
+from load import (
+    create_data_warehouse, load_staging_table, build_staging_aggregates,
+    publish_staging_tables, load_data_warehouse
+)
+from utils.task_runner import Task
+from utils.checkpoint import write_parquet_chunks, read_parquet_chunks, reset_directory
+from utils import metrics
+from config import TRANSFORM_WORKERS
+
+# The ETL as a graph of tasks, run by utils.task_runner. Each phase's tasks
+# are added to the graph once the previous phase has decided what to do:
+# the extract tasks fetch and fingerprint every source, the transform tasks
+# build each dimension and the facts, and the load tasks write the warehouse tables the
+# changed sources feed. Task outputs are kept by task name, so the cleaned
+# orders are the output of 'clean_orders', the customer dimension that of
+# 'dim_customer' and so on.
+
+# Warehouse dimension tables built by the transform tasks
+DIMENSION_TASKS = ['dim_customer', 'dim_product', 'dim_date', 'dim_exchange_rate']
+
+# Fact lookups of a fact transform worker process, broadcast to it once by
+# init_fact_worker rather than sent with every partition
+worker_lookups = None
+
+def collect(*outputs, names):
+    """Gather the outputs of several tasks into a dict by name."""
+    return dict(zip(names, outputs))
+
+def extract_tasks(high_water_mark=None):
+    """Tasks extracting and fingerprinting every source.
+    
+    The database download, cities snapshot, exchange rates and warehouse
+    lookups are independent; each source table is read, and fingerprinted,
+    on its own read-only connection once the database is available. The
+    order sources are fingerprinted per OrderID range, up to the high-water
+    mark as well. The 'fingerprints' task gathers the fingerprint of every
+    source.
+    """
+    tasks = [
+        Task('database', download_database),
+        Task('cities_snapshot', get_cities_snapshot),
+        Task('exchange_rates', get_exchange_rates),
+        Task('exchange_rate_history', load_exchange_rate_history),
+        Task('dimension_keys', load_dimension_keys)
+    ]
+    for name, (query, params) in source_table_queries(high_water_mark).items():
+        tasks.append(Task(
+            f'extract_{name}',
+            partial(read_source_table, query=query, params=params),
+            requires=['database']
+        ))
+    for name, table_name in SOURCE_TABLES.items():
+        if name in ORDER_SOURCES:
+            fingerprint = partial(
+                fingerprint_order_table, table_name=table_name, high_water_mark=high_water_mark
+            )
+        else:
+            fingerprint = partial(fingerprint_source_table, table_name=table_name)
+        tasks.append(Task(f'fingerprint_{name}', fingerprint, requires=['database']))
+    tasks += [
+        Task('fingerprint_world_cities', fingerprint_cities, requires=['cities_snapshot']),
+        Task('fingerprint_exchange_rates', fingerprint_exchange_rates, requires=['exchange_rates'])
+    ]
+    sources = [*SOURCE_TABLES, 'world_cities', 'exchange_rates']
+    tasks.append(Task(
+        'fingerprints',
+        partial(collect, names=sources),
+        requires=[f'fingerprint_{name}' for name in sources]
+    ))
+    return tasks
+
+def clean_table(df, name):
+    """Clean an extracted source table with its cleaning policy."""
+    cleaned, metrics = clean_dataframe(df, CLEANING_POLICIES.get(name))
+    logger.info(f"Cleaned {name}: {metrics}")
+    return cleaned
+
+def match_customer_cities(dim_customer, cities_snapshot):
+    """Match the customers' addresses to world cities."""
+    city_matches = match_cities(dim_customer, cities_snapshot)
+    matched = city_matches['city_id'].notna().sum()
+    logger.info(f"Matched {matched} of {len(city_matches)} customer addresses to world cities")
+    return city_matches
+
+def customer_dimension(customers, dimension_keys):
+    """Create the customer dimension, keeping the surrogate keys already assigned."""
+    return create_customer_dimension(customers, dimension_keys['dim_customer'])
+
+def product_dimension(products, categories, suppliers, dimension_keys):
+    """Create the product dimension, keeping the surrogate keys already assigned."""
+    return create_product_dimension(products, categories, suppliers, dimension_keys['dim_product'])
+
+def fact_stream(conn, high_water_mark, orders, dimensions):
+    """Stream fact chunks built from the order details read on conn.
+    
+    The cleaning metrics of the order details are logged once the stream
+    is exhausted.
+    """
+    cleaning_metrics = {}
+    order_details = clean_chunks(iter_order_details(conn, high_water_mark), metrics=cleaning_metrics)
+    yield from create_fact_chunks(order_details, {'orders': orders}, dimensions)
+    logger.info(f"Cleaned order_details: {cleaning_metrics}")
+
+def init_fact_worker(lookups):
+    """Set up a fact transform worker process with the broadcast fact lookups."""
+    global worker_lookups
+    worker_lookups = lookups
+
+def build_fact_partition(db_path, high_water_mark, order_range, partition, fact_dir):
+    """Build the facts of one OrderID range into Parquet chunks, in a worker process.
+    
+    The order details are read on the worker's own read-only connection.
+    Returns the partition's row count, cleaning metrics and step metrics,
+    the whole partition being measured as pipeline.build_fact_partition.
+    """
+    cleaning_metrics = {}
+    steps = metrics.start_step_metrics()
+    try:
+        with metrics.step('pipeline.build_fact_partition') as partition_metrics:
+            with closing(get_read_only_connection(db_path)) as conn:
+                order_details = clean_chunks(
+                    iter_order_details(conn, high_water_mark, order_range=order_range),
+                    metrics=cleaning_metrics
+                )
+                facts = (create_fact_table(chunk, **worker_lookups) for chunk in order_details)
+                row_count = write_parquet_chunks(facts, fact_dir, partition)
+            partition_metrics['rows_out'] = row_count
+    finally:
+        metrics.finish_step_metrics()
+    return row_count, cleaning_metrics, steps
+
+def build_fact_partitions(db_path, high_water_mark, partitions, lookups, fact_dir, workers):
+    """Build the facts of each OrderID range in parallel on a process pool.
+    
+    Workers are spawned rather than forked, since the ETL runs tasks on
+    other threads while they start. The workers' step metrics are merged
+    into the job's, and their CPU time into that of the steps waiting for
+    them. Returns the number of rows built.
+    """
+    reset_directory(fact_dir)
+    cleaning_metrics, row_count = {}, 0
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(partitions)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_fact_worker,
+        initargs=(lookups,)
+    ) as executor:
+        futures = [
+            executor.submit(build_fact_partition, db_path, high_water_mark, order_range, partition, fact_dir)
+            for partition, order_range in enumerate(partitions)
+        ]
+        for future in futures:
+            partition_rows, partition_metrics, partition_steps = future.result()
+            row_count += partition_rows
+            if partition_metrics:
+                merge_cleaning_metrics(cleaning_metrics, partition_metrics)
+            metrics.merge_step_metrics(
+                partition_steps, partition_steps['pipeline.build_fact_partition']['cpu_seconds']
+            )
+    logger.info(f"Cleaned order_details: {cleaning_metrics}")
+    return row_count
+
+def build_facts(db_path, orders, dim_customer, dim_product, dim_exchange_rate, high_water_mark=None,
+                fact_dir=None, workers=TRANSFORM_WORKERS):
+    """Build fact_sales from the order details into Parquet chunks in fact_dir.
+    
+    Order details are read, joined and converted chunk by chunk, so only
+    one chunk per process is in memory at a time. With several workers,
+    extracts of more than one partition are split into OrderID ranges
+    built in parallel by worker processes. Returns fact_dir.
+    """
+    dimensions = {
+        'dim_customer': dim_customer,
+        'dim_product': dim_product,
+        'dim_exchange_rate': dim_exchange_rate
+    }
+    with closing(get_database_connection(db_path)) as conn:
+        partitions = order_detail_partitions(conn, high_water_mark) if workers > 1 else []
+        if len(partitions) < 2:
+            row_count = write_parquet_chunks(fact_stream(conn, high_water_mark, orders, dimensions), fact_dir)
+    if len(partitions) >= 2:
+        logger.info(f"Building facts in {len(partitions)} partitions on up to {workers} processes")
+        row_count = build_fact_partitions(
+            db_path, high_water_mark, partitions, build_fact_lookups(orders, dimensions), fact_dir, workers
+        )
+    logger.info(f"Built {row_count} fact rows")
+    return fact_dir
+
+def transform_tasks(high_water_mark=None, tables=(), fact_dir=None, workers=TRANSFORM_WORKERS):
+    """Tasks cleaning the source tables and building every dimension, and the
+    facts if fact_sales is among the tables being rebuilt.
+    
+    Each dimension only waits for the tables it is built from, so e.g. the
+    product dimension is built while customer addresses are being matched
+    to world cities. The facts are written as Parquet chunks to fact_dir,
+    on up to workers processes.
+    """
+    tasks = [
+        Task(f'clean_{name}', partial(clean_table, name=name), requires=[f'extract_{name}'])
+        for name in source_table_queries(high_water_mark)
+    ]
+    tasks += [
+        Task(
+            'customer_dimension',
+            customer_dimension,
+            requires=['clean_customers', 'dimension_keys']
+        ),
+        Task(
+            'city_matches',
+            match_customer_cities,
+            requires=['customer_dimension', 'cities_snapshot']
+        ),
+        Task(
+            'dim_customer',
+            enrich_customer_dimension,
+            requires=['customer_dimension', 'city_matches']
+        ),
+        Task(
+            'dim_product',
+            product_dimension,
+            requires=['clean_products', 'clean_categories', 'clean_suppliers', 'dimension_keys']
+        ),
+        Task('dim_date', create_order_date_dimension, requires=['clean_orders']),
+        Task(
+            'dim_exchange_rate',
+            create_exchange_rate_dimension,
+            requires=['exchange_rates', 'exchange_rate_history']
+        )
+    ]
+    if 'fact_sales' in tables:
+        tasks.append(Task(
+            'fact_sales',
+            partial(build_facts, high_water_mark=high_water_mark, fact_dir=fact_dir, workers=workers),
+            requires=['database', 'clean_orders', 'dim_customer', 'dim_product', 'dim_exchange_rate']
+        ))
+    return tasks
+
+def load_dimension(df, name):
+    """Load a dimension into its staging table."""
+    with closing(create_data_warehouse()) as dwh_conn:
+        return load_staging_table(dwh_conn, name, [df])
+
+def load_facts(fact_dir):
+    """Load the fact chunks built by build_facts into the fact_sales staging table."""
+    with closing(create_data_warehouse()) as dwh_conn:
+        return load_staging_table(dwh_conn, 'fact_sales', read_parquet_chunks(fact_dir))
+
+def build_aggregates(*loaded, tables):
+    """Build the aggregate tables from the staged tables; returns their names."""
+    with closing(create_data_warehouse()) as dwh_conn:
+        return build_staging_aggregates(dwh_conn, tables)
+
+def publish(aggregate_names, tables):
+    """Publish the staged tables and aggregates to the warehouse."""
+    with closing(create_data_warehouse()) as dwh_conn:
+        publish_staging_tables(dwh_conn, list(tables) + aggregate_names)
+    return list(tables) + aggregate_names
+
+def upsert_warehouse(*outputs, tables, order_ranges=()):
+    """Upsert the extracted delta of the given tables into the live warehouse.
+    
+    outputs are the dimensions, in DIMENSION_TASKS order, followed by the
+    fact chunk directory if fact_sales is among the tables. The facts of
+    order_ranges are replaced by those extracted. An incremental load is a
+    single transaction, so it is one task.
+    """
+    dimensions = dict(zip(DIMENSION_TASKS, outputs))
+    fact_sales = read_parquet_chunks(outputs[len(DIMENSION_TASKS)]) if 'fact_sales' in tables else []
+    load_data_warehouse(
+        fact_sales, dimensions, incremental=True, tables=tables, order_ranges=order_ranges
+    ).close()
+    return sorted(tables)
+
+def load_tasks(tables, incremental=False, order_ranges=()):
+    """Tasks loading the given warehouse tables.
+    
+    A full load stages each table in its own task, so a failure only
+    reloads that table, then builds the aggregates and publishes everything
+    together in 'publish'. The staging loads share the warehouse resource:
+    SQLite has a single writer. An incremental load is one 'publish' task
+    upserting every table in a single transaction, replacing the facts of
+    the OrderID order_ranges extracted again.
+    """
+    if incremental:
+        return [Task(
+            'publish',
+            partial(upsert_warehouse, tables=tables, order_ranges=order_ranges),
+            requires=[*DIMENSION_TASKS, *(['fact_sales'] if 'fact_sales' in tables else [])],
+            resource='warehouse'
+        )]
+    
+    tasks = [
+        Task(f'load_{name}', partial(load_dimension, name=name), requires=[name], resource='warehouse')
+        for name in DIMENSION_TASKS if name in tables
+    ]
+    if 'fact_sales' in tables:
+        tasks.append(Task('load_fact_sales', load_facts, requires=['fact_sales'], resource='warehouse'))
+    tasks += [
+        Task(
+            'build_aggregates',
+            partial(build_aggregates, tables=sorted(tables)),
+            requires=[task.name for task in tasks],
+            resource='warehouse'
+        ),
+        Task(
+            'publish',
+            partial(publish, tables=sorted(tables)),
+            requires=['build_aggregates'],
+            resource='warehouse'
+        )
+    ]
+    return tasks
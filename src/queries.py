@@ -0,0 +1,201 @@
+import sqlite3
+import pandas as pd
+from load import AGGREGATE_TABLES
+from config import REGRESSION_BASELINE_RUNS, REGRESSION_THRESHOLD
+
+# SQL rolling the aggregate table measures up for each aggregation function
+MEASURES = {
+    'Sum': "SUM(t.RevenueSum)",
+    'Average': "SUM(t.RevenueSum) / SUM(t.SalesCount)",
+    'Count': "SUM(t.SalesCount)",
+    'Min': "MIN(t.RevenueMin)",
+    'Max': "MAX(t.RevenueMax)"
+}
+
+# Aggregate table, grouping columns and output labels for each
+# (dimension, level) of the Roll-up & Drill-down hierarchies. Time levels
+# group on the integer calendar keys; their text labels are only formatted
+# for the aggregated rows.
+HIERARCHY_LEVELS = {
+    ('Time', 'Year'): ('agg_sales_time', ['Year'], {'Year': "t.Year"}),
+    ('Time', 'Quarter'): ('agg_sales_time', ['Year', 'Quarter'], {'Quarter': "t.Year || 'Q' || t.Quarter"}),
+    ('Time', 'Month'): ('agg_sales_time', ['Year', 'Month'], {'Month': "printf('%d-%02d', t.Year, t.Month)"}),
+    ('Time', 'Day'): ('agg_sales_time', ['DateKey'], {
+        'Day': "printf('%d-%02d-%02d', t.DateKey / 10000, t.DateKey / 100 % 100, t.DateKey % 100)"
+    }),
+    ('Geography', 'Country'): ('agg_sales_geography', ['Country'], {'Country': "t.Country"}),
+    ('Geography', 'City'): ('agg_sales_geography', ['Country', 'City'], {'Country': "t.Country", 'City': "t.City"}),
+    ('Product', 'Category'): ('agg_sales_product', ['CategoryName'], {'CategoryName': "t.CategoryName"}),
+    ('Product', 'Product'): ('agg_sales_product', ['ProductName'], {'ProductName': "t.ProductName"})
+}
+
+# Aggregate table serving Slice & Dice and Pivot Analysis
+DIMENSIONS_TABLE = 'agg_sales_dimensions'
+
+# ETL jobs charted on the Operational Performance page
+JOB_NAMES = ['extract_data', 'transform_data', 'load_data']
+
+# How the revenue measures of pivot cells roll up into the totals, and the
+# measure each aggregation function reads (averages are sum / count)
+PIVOT_ROLLUPS = {'RevenueSum': 'sum', 'SalesCount': 'sum', 'RevenueMin': 'min', 'RevenueMax': 'max'}
+PIVOT_MEASURES = {'Sum': 'RevenueSum', 'Count': 'SalesCount', 'Min': 'RevenueMin', 'Max': 'RevenueMax'}
+
+def filter_clause(years=None, countries=None, filters=None):
+    """Build the WHERE clause and parameters for the dashboard's filters.
+    
+    Years and countries are the global filters; filters maps further
+    columns to required values.
+    """
+    conditions, params = [], []
+    if years:
+        conditions.append(f"t.Year IN ({', '.join('?' for _ in years)})")
+        params.extend(int(year) for year in years)
+    if countries:
+        conditions.append(f"t.Country IN ({', '.join('?' for _ in countries)})")
+        params.extend(countries)
+    for col, value in (filters or {}).items():
+        conditions.append(f"t.{col} = ?")
+        params.append(value)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+def check_columns(table, columns):
+    """Reject columns an aggregate table doesn't have before they reach SQL."""
+    for col in columns:
+        if col not in AGGREGATE_TABLES[table]:
+            raise ValueError(f"{table} has no column {col}")
+
+def build_query(table, group_by, labels=None, agg_func='Sum', years=None, countries=None, filters=None):
+    """Build a parameterized GROUP BY query over an aggregate table.
+    
+    Returns the SQL and its parameters. The result has one row per group,
+    with the label columns and the aggregated measure as RevenueEUR.
+    """
+    check_columns(table, list(group_by) + list(filters or {}))
+    labels = labels or {col: f"t.{col}" for col in group_by}
+    where, params = filter_clause(years, countries, filters)
+    
+    select = ", ".join(f"{expr} AS {name}" for name, expr in labels.items())
+    group = ", ".join(f"t.{col}" for col in group_by)
+    sql = f"""
+    SELECT {select}, {MEASURES[agg_func]} AS RevenueEUR
+    FROM {table} t
+    {where}
+    GROUP BY {group}
+    ORDER BY {group}
+    """
+    return sql, tuple(params)
+
+def level_query(dimension, level, years=None, countries=None, filters=None):
+    """Build the query for one level of a Roll-up & Drill-down hierarchy."""
+    table, group_by, labels = HIERARCHY_LEVELS[(dimension, level)]
+    return build_query(table, group_by, labels, 'Sum', years, countries, filters)
+
+def pivot_query(rows, cols, years=None, countries=None):
+    """Build the query returning the revenue measures of every (rows, cols) cell.
+    
+    Each cell carries the sum, count, minimum and maximum of revenue, from
+    which pivot_matrix derives any aggregation function and the totals.
+    """
+    check_columns(DIMENSIONS_TABLE, [rows, cols])
+    where, params = filter_clause(years, countries)
+    sql = f"""
+    SELECT t.{rows} AS {rows}, t.{cols} AS {cols},
+        SUM(t.RevenueSum) AS RevenueSum, SUM(t.SalesCount) AS SalesCount,
+        MIN(t.RevenueMin) AS RevenueMin, MAX(t.RevenueMax) AS RevenueMax
+    FROM {DIMENSIONS_TABLE} t
+    {where}
+    GROUP BY t.{rows}, t.{cols}
+    ORDER BY t.{rows}, t.{cols}
+    """
+    return sql, tuple(params)
+
+def pivot_measure(measures, agg_func):
+    """Compute an aggregation function from rolled-up revenue measures."""
+    if agg_func == 'Average':
+        return measures['RevenueSum'] / measures['SalesCount']
+    return measures[PIVOT_MEASURES[agg_func]]
+
+def pivot_matrix(cells, rows, cols, agg_func='Sum', total_label='Total'):
+    """Pivot the cells of pivot_query into a rows x cols matrix with totals.
+    
+    The row, column and grand totals are rolled up from the cells' measures
+    rather than by adding up the matrix, so they are right for averages,
+    minima and maxima too. The last row and column hold the totals; cells
+    without sales are NaN.
+    """
+    row_totals = cells.groupby(rows).agg(PIVOT_ROLLUPS)
+    col_totals = cells.groupby(cols).agg(PIVOT_ROLLUPS)
+    grand_total = cells[list(PIVOT_ROLLUPS)].agg(PIVOT_ROLLUPS)
+    
+    matrix = pivot_measure(cells.set_index([rows, cols]), agg_func).unstack(cols)
+    matrix[total_label] = pivot_measure(row_totals, agg_func)
+    matrix.loc[total_label] = pivot_measure(col_totals, agg_func)
+    matrix.loc[total_label, total_label] = pivot_measure(grand_total, agg_func)
+    return matrix
+
+def distinct_values_query(table, column, years=None, countries=None):
+    """Build the query listing the distinct values of a column, e.g. for filter options."""
+    check_columns(table, [column])
+    where, params = filter_clause(years, countries)
+    sql = f"SELECT DISTINCT t.{column} AS {column} FROM {table} t {where} ORDER BY 1"
+    return sql, tuple(params)
+
+def run_query(conn, sql, params=()):
+    """Run a dashboard query and return its rows as a DataFrame."""
+    return pd.read_sql(sql, conn, params=params)
+
+def job_history_query(job_names, since):
+    """Build the query listing the runs of jobs started since a time, oldest first.
+    
+    Served by the job_metadata (job_name, start_time) index, so it only
+    reads the requested period however long the history is.
+    """
+    sql = f"""
+    SELECT j.job_id, j.job_name, j.start_time, j.status, j.duration_seconds
+    FROM job_metadata j
+    WHERE j.job_name IN ({', '.join('?' for _ in job_names)}) AND j.start_time >= ?
+    ORDER BY j.start_time
+    """
+    return sql, (*job_names, since)
+
+def step_metrics_query(job_names, since):
+    """Build the query listing the step metrics of successful job runs started since a time."""
+    sql = f"""
+    SELECT j.job_id, j.job_name, j.start_time, m.step_name, m.calls, m.wall_seconds,
+        m.cpu_seconds, m.rows_in, m.rows_out, m.peak_memory_mb
+    FROM job_metadata j
+    JOIN job_step_metrics m ON m.job_id = j.job_id
+    WHERE j.job_name IN ({', '.join('?' for _ in job_names)}) AND j.start_time >= ?
+        AND j.status = 'success'
+    ORDER BY j.start_time
+    """
+    return sql, (*job_names, since)
+
+def flag_regressions(runs, value, by, baseline_runs=REGRESSION_BASELINE_RUNS, threshold=REGRESSION_THRESHOLD):
+    """Compare each run with the rolling baseline of the runs before it.
+    
+    runs must be in chronological order. Adds a Baseline column (median of
+    value over the previous baseline_runs runs of the same group of by
+    columns) and a Regression column, true where value exceeds threshold
+    times the baseline.
+    """
+    baseline = runs.groupby(by)[value].transform(
+        lambda values: values.shift().rolling(baseline_runs, min_periods=1).median()
+    )
+    return runs.assign(Baseline=baseline, Regression=runs[value] > threshold * baseline)
+
+def warehouse_version(conn):
+    """Id of the last successful load_data job, which changes whenever the warehouse is reloaded.
+    
+    Returns None before the first load.
+    """
+    try:
+        row = conn.execute(
+            "SELECT MAX(job_id) FROM job_metadata WHERE job_name = 'load_data' AND status = 'success'"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # The ETL hasn't created the job metadata table yet
+        return None
+    return row[0]
@@ -1,5 +1,9 @@
 import schedule
 import time
+import cProfile
+import io
+import pstats
+import pandas as pd
 from datetime import datetime
 from pathlib import Path
 import sys
@@ -10,106 +14,214 @@ src_path = Path(__file__).parent
 sys.path.append(str(src_path))
 
 from utils.logger import get_logger
-from utils.job_metadata import log_job_start, log_job_end, init_job_metadata, get_job_history
-from extract import download_database, get_database_connection, load_tables, load_cities_data, get_exchange_rate
-from transform import clean_dataframes, create_dimensions, create_fact_table, enrich_customer_dimension
-from load import load_data_warehouse, add_revenue_eur
+from utils.job_metadata import (
+    log_job_start, log_job_end, init_job_metadata, get_job_history,
+    get_high_water_mark, set_high_water_mark, get_source_fingerprints,
+    record_source_fingerprints, get_source_range_fingerprints, record_step_metrics,
+    get_step_metrics
+)
+from utils.metrics import start_step_metrics, finish_step_metrics
+from utils.task_runner import run_tasks
+from utils.checkpoint import RunCheckpoint, prune_checkpoints
+from config import LOG_DIR, TASK_WORKERS, TRANSFORM_WORKERS
+from extract import changed_sources, stale_order_ranges
+from pipeline import extract_tasks, transform_tasks, load_tasks, DIMENSION_TASKS
+from schema import memory_report
+from load import warehouse_schema_is_current, tables_to_rebuild
 
 # Configure logging
 logger = get_logger()
 
-def run_etl():
-    """Run the complete ETL process."""
-    logger.info("Starting ETL process...")
+def run_etl(full_refresh=False, checkpoint=None, task_workers=TASK_WORKERS,
+            transform_workers=TRANSFORM_WORKERS):
+    """Run the ETL process as a graph of tasks.
+    
+    By default only orders past the high-water mark of the last successful
+    run are processed and upserted; a full refresh rebuilds every table.
+    Incremental runs also compare the source fingerprints with those of the
+    last successful load: only tables depending on changed sources are
+    rebuilt, and a run where nothing changed stops after fingerprinting.
+    Orders loaded before whose source rows changed are found by OrderID
+    range, and extracted and loaded again with the new orders.
+    
+    Independent tasks run concurrently and a failing task is retried on its
+    own with exponential backoff. Every task output is saved in the run's
+    checkpoint (a RunCheckpoint, by default a new one); passing the
+    checkpoint of a failed run resumes it without redoing its completed
+    tasks. task_workers threads run the tasks (0 runs them in this thread)
+    and transform_workers processes build the facts.
+    """
+    if checkpoint is None:
+        checkpoint = RunCheckpoint.create(full_refresh)
+    logger.info(f"Starting ETL process (run {checkpoint.run_id})...")
     
     try:
         # Extract
         job_id = log_job_start('extract_data')
+        start_step_metrics()
         logger.info("Starting data extraction...")
         
-        # Download and connect to database
-        db_path = download_database()
-        conn = get_database_connection(db_path)
+        # A resumed run keeps the high-water mark its outputs were extracted with
+        if 'high_water_mark' in checkpoint:
+            high_water_mark = checkpoint['high_water_mark']
+        else:
+            high_water_mark = None if full_refresh else get_high_water_mark()
+            if high_water_mark is not None and not warehouse_schema_is_current():
+                logger.info("Warehouse schema is outdated, rebuilding it with a full refresh")
+                high_water_mark = None
+            checkpoint['high_water_mark'] = high_water_mark
+        incremental = high_water_mark is not None
+        if incremental:
+            logger.info(f"Running incremental load from high-water mark {high_water_mark}")
+        else:
+            logger.info("Running full refresh")
         
-        # Load tables
-        tables = load_tables(conn)
-        logger.info("Loaded all tables from database")
+        # Fingerprint every source first: only the tables whose sources
+        # changed since the last load are rebuilt
+        tasks = extract_tasks(high_water_mark)
+        run_tasks(tasks, checkpoint, targets=['fingerprints'], max_workers=task_workers)
+        fingerprints = checkpoint['fingerprints']
+        if incremental:
+            changed = changed_sources(fingerprints, get_source_fingerprints())
+            stale_ranges = stale_order_ranges(fingerprints, get_source_range_fingerprints())
+            if stale_ranges:
+                logger.info(f"Orders loaded before changed; reloading OrderID ranges {stale_ranges}")
+                high_water_mark = {**high_water_mark, 'stale_ranges': stale_ranges}
+        else:
+            changed = set(fingerprints)
+        rebuild_tables = tables_to_rebuild(changed)
         
-        # Load cities data
-        world_cities = load_cities_data()
-        logger.info("Loaded world cities data")
+        if not changed:
+            record_step_metrics(job_id, finish_step_metrics())
+            log_job_end(job_id, 'success')
+            checkpoint.set_status('complete')
+            prune_checkpoints()
+            logger.info("No source changed since the last load, skipping transform and load")
+            return
+        logger.info(f"Changed sources: {sorted(changed)}; rebuilding {sorted(rebuild_tables)}")
         
-        # Get exchange rate
-        exchange_rate = get_exchange_rate()
-        logger.info(f"Got exchange rate: {exchange_rate}")
+        # Extract the source tables, world cities, exchange rates and
+        # warehouse lookups concurrently
+        tasks = extract_tasks(high_water_mark)
+        run_tasks(tasks, checkpoint, max_workers=task_workers)
+        logger.info(f"Loaded all tables from database ({len(checkpoint['extract_orders'])} orders)")
+        logger.info(f"Got exchange rates: {checkpoint['exchange_rates']}")
         
+        record_step_metrics(job_id, finish_step_metrics())
         log_job_end(job_id, 'success')
         logger.info("Data extraction completed successfully")
         
         # Transform
         job_id = log_job_start('transform_data')
+        start_step_metrics()
         logger.info("Starting data transformation...")
         
-        # Clean data
-        cleaned_tables = clean_dataframes(tables)
-        logger.info("Cleaned all tables")
-        
-        # Create dimensions
-        dimensions = create_dimensions(cleaned_tables)
-        logger.info("Created dimension tables")
-        
-        # Create fact table
-        fact_sales = create_fact_table(cleaned_tables)
-        logger.info("Created fact table")
-        
-        # Enrich customer dimension
-        dimensions['dim_customer'] = enrich_customer_dimension(
-            dimensions['dim_customer'],
-            world_cities
+        # Clean the source tables and build each dimension, enriching
+        # customers with the world cities matched to their addresses; order
+        # details are read, joined and converted to fact rows chunk by chunk
+        tasks += transform_tasks(
+            high_water_mark, rebuild_tables, checkpoint.path('fact_sales_chunks'), transform_workers
         )
-        logger.info("Enriched customer dimension")
+        run_tasks(tasks, checkpoint, max_workers=task_workers)
+        dimensions = {name: checkpoint[name] for name in DIMENSION_TASKS}
+        logger.info("Created dimension tables")
+        for name, usage in memory_report(dimensions).items():
+            logger.info(f"In-memory {name}: {usage}")
         
+        record_step_metrics(job_id, finish_step_metrics())
         log_job_end(job_id, 'success')
         logger.info("Data transformation completed successfully")
         
         # Load
         job_id = log_job_start('load_data')
+        start_step_metrics()
         logger.info("Starting data loading...")
         
         # Load data into warehouse
-        dwh_conn = load_data_warehouse(fact_sales, dimensions)
-        logger.info("Loaded data into warehouse")
+        tasks += load_tasks(rebuild_tables, incremental, (high_water_mark or {}).get('stale_ranges', []))
+        run_tasks(tasks, checkpoint, max_workers=task_workers)
+        logger.info(f"Loaded {checkpoint['publish']} into warehouse")
+        
+        # Record what was loaded so the next run can detect changes
+        record_source_fingerprints(job_id, fingerprints)
         
-        # Add EUR revenue
-        add_revenue_eur(dwh_conn, exchange_rate)
-        logger.info("Added EUR revenue")
+        # Advance the high-water mark past the orders just loaded; the delta
+        # can stop short of the mark, e.g. when only old ranges were reloaded
+        orders = checkpoint['clean_orders']
+        if not orders.empty:
+            max_order_id = int(orders['OrderID'].max())
+            max_order_date = pd.Timestamp(orders['OrderDate'].max())
+            if high_water_mark is not None:
+                max_order_id = max(max_order_id, int(high_water_mark['max_order_id']))
+                max_order_date = max(max_order_date, pd.Timestamp(high_water_mark['max_order_date']))
+            set_high_water_mark(max_order_id, max_order_date, job_id)
+            logger.info(f"High-water mark set to OrderID {max_order_id}")
         
+        record_step_metrics(job_id, finish_step_metrics())
         log_job_end(job_id, 'success')
         logger.info("Data loading completed successfully")
         
+        checkpoint.set_status('complete')
+        prune_checkpoints()
         logger.info("ETL process completed successfully!")
         
     except Exception as e:
+        finish_step_metrics()
+        checkpoint.set_status('failed')
         logger.error(f"ETL process failed: {str(e)}")
+        logger.info(f"Resume it with --resume; its checkpoint is in {checkpoint.run_dir}")
         raise
 
-def run_etl_with_error_handling():
-    """Run ETL with error handling and retries."""
+def run_etl_with_error_handling(full_refresh=False, resume=False):
+    """Run ETL with error handling and retries.
+    
+    Failing tasks are already retried by the task runner; a run whose task
+    ran out of retries is resumed from its checkpoint, so only that task
+    and the ones after it are run again. With resume, the latest run is
+    resumed from its checkpoint if it didn't complete.
+    """
     max_retries = 3
     retry_delay = 300  # 5 minutes
+    checkpoint = RunCheckpoint.latest_unfinished() if resume else None
+    if checkpoint is not None:
+        full_refresh = checkpoint.full_refresh
+        logger.info(f"Resuming run {checkpoint.run_id} from its checkpoint")
+    else:
+        if resume:
+            logger.info("The last run completed, there is nothing to resume; starting a new run")
+        checkpoint = RunCheckpoint.create(full_refresh)
     
     for attempt in range(max_retries):
         try:
-            run_etl()
+            run_etl(full_refresh=full_refresh, checkpoint=checkpoint)
             return
         except Exception as e:
             if attempt < max_retries - 1:
-                logger.warning(f"Attempt {attempt + 1} failed. Retrying in {retry_delay} seconds...")
+                logger.warning(f"Attempt {attempt + 1} failed. Resuming in {retry_delay} seconds...")
                 time.sleep(retry_delay)
             else:
                 logger.error(f"All {max_retries} attempts failed. Last error: {str(e)}")
                 raise
 
+def profile_etl(full_refresh=False):
+    """Run the ETL once under cProfile and save the profile to the logs directory.
+    
+    The .prof file can be read with pstats, or turned into a flame graph by
+    tools such as snakeviz or flameprof. The tasks, and the fact build, run
+    one at a time in this thread so that the profile covers all their work.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run_etl, full_refresh=full_refresh, task_workers=0, transform_workers=1)
+    finally:
+        profile_path = LOG_DIR / f"etl_profile_{datetime.now():%Y%m%d_%H%M%S}.prof"
+        profiler.dump_stats(profile_path)
+        logger.info(f"Saved profile to {profile_path}")
+        
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+        logger.info(f"Top functions by cumulative time:\n{summary.getvalue()}")
+
 def show_status():
     """Show current scheduler status and next run time."""
     next_run = schedule.next_run()
@@ -130,14 +242,28 @@ def show_status():
         start_time = datetime.fromisoformat(job['start_time'])
         duration = job['duration'] if job['duration'] is not None else 0
         logger.info(f"{status} {job['job_name']} - {start_time} ({duration:.1f}s)")
+        
+        # Break each job down into its slowest steps
+        for metrics in get_step_metrics(job['job_id'])[:3]:
+            rows = f", {metrics['rows_out']} rows out" if metrics['rows_out'] else ""
+            logger.info(
+                f"    {metrics['step_name']}: {metrics['wall_seconds']:.2f}s wall, "
+                f"{metrics['cpu_seconds']:.2f}s CPU{rows}"
+            )
 
 def main():
     """Main function to set up and run the scheduler."""
     parser = argparse.ArgumentParser(description='Northwind ETL Scheduler')
     parser.add_argument('--once', action='store_true', help='Run ETL once without scheduling')
     parser.add_argument('--status', action='store_true', help='Show scheduler status and recent history')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='Rebuild the whole warehouse instead of loading only new orders')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume the last run from its checkpoint if it failed, then run once')
+    parser.add_argument('--profile', action='store_true',
+                        help='Run ETL once under cProfile and save the profile to the logs directory')
     args = parser.parse_args()
-
+    
     logger.info("Starting ETL scheduler...")
     
     # Initialize job metadata table
@@ -147,22 +273,27 @@ def main():
     except Exception as e:
         logger.error(f"Failed to initialize job metadata table: {str(e)}")
         raise
-
+    
     if args.status:
         show_status()
         return
-
-    if args.once:
+    
+    if args.profile:
+        logger.info("Running ETL once under the profiler...")
+        profile_etl(full_refresh=args.full_refresh)
+        return
+    
+    if args.once or args.resume:
         logger.info("Running ETL once (no scheduling)...")
-        run_etl_with_error_handling()
+        run_etl_with_error_handling(full_refresh=args.full_refresh, resume=args.resume)
         return
     
     # Schedule the ETL job to run daily at midnight
-    schedule.every().day.at("00:00").do(run_etl_with_error_handling)
+    schedule.every().day.at("00:00").do(run_etl_with_error_handling, full_refresh=args.full_refresh)
     
     # Run the job immediately on startup
     logger.info("Running initial ETL job...")
-    run_etl_with_error_handling()
+    run_etl_with_error_handling(full_refresh=args.full_refresh)
     
     # Show status after initial run
     show_status()
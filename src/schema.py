@@ -0,0 +1,111 @@
+import pandas as pd
+from config import REPORTING_CURRENCIES
+
+# Star schema of the data warehouse: declared column types and primary keys.
+# Dimensions are keyed by integer surrogate keys which fact_sales references;
+# the foreign keys are declared but not enforced during bulk loads.
+# Low-cardinality text columns listed as categorical are held as pandas
+# categoricals in memory, so each distinct value is stored once.
+WAREHOUSE_SCHEMA = {
+    'fact_sales': {
+        'columns': {
+            'OrderID': 'INTEGER NOT NULL',
+            'CustomerKey': 'INTEGER REFERENCES dim_customer (CustomerKey)',
+            'ProductKey': 'INTEGER REFERENCES dim_product (ProductKey)',
+            'DateKey': 'INTEGER REFERENCES dim_date (DateKey)',
+            'CustomerID': 'TEXT',
+            'ProductID': 'INTEGER NOT NULL',
+            'OrderDate': 'TIMESTAMP',
+            'Quantity': 'INTEGER',
+            'UnitPrice': 'REAL',
+            'Discount': 'REAL',
+            'RevenueUSD': 'REAL',
+            **{f'Revenue{currency}': 'REAL' for currency in REPORTING_CURRENCIES}
+        },
+        'primary_key': ['OrderID', 'ProductID'],
+        'categorical': ['CustomerID']
+    },
+    'dim_customer': {
+        'columns': {
+            'CustomerKey': 'INTEGER NOT NULL',
+            'CustomerID': 'TEXT NOT NULL UNIQUE',
+            'CompanyName': 'TEXT',
+            'ContactName': 'TEXT',
+            'City': 'TEXT',
+            'Country': 'TEXT',
+            'Region': 'TEXT',
+            'Latitude': 'REAL',
+            'Longitude': 'REAL',
+            'CityPopulation': 'REAL'
+        },
+        'primary_key': ['CustomerKey'],
+        'categorical': ['City', 'Country', 'Region']
+    },
+    'dim_product': {
+        'columns': {
+            'ProductKey': 'INTEGER NOT NULL',
+            'ProductID': 'INTEGER NOT NULL UNIQUE',
+            'ProductName': 'TEXT',
+            'CategoryName': 'TEXT',
+            'SupplierName': 'TEXT',
+            'SupplierCountry': 'TEXT'
+        },
+        'primary_key': ['ProductKey'],
+        'categorical': ['CategoryName', 'SupplierName', 'SupplierCountry']
+    },
+    'dim_date': {
+        'columns': {
+            'DateKey': 'INTEGER NOT NULL',  # YYYYMMDD
+            'FullDate': 'DATE NOT NULL',
+            'Year': 'INTEGER',
+            'Quarter': 'INTEGER',
+            'Month': 'INTEGER',
+            'Day': 'INTEGER',
+            'Weekday': 'INTEGER'  # ISO weekday, Monday = 1
+        },
+        'primary_key': ['DateKey'],
+        'categorical': []
+    },
+    'dim_exchange_rate': {
+        'columns': {
+            'RateDate': 'DATE NOT NULL',
+            'Currency': 'TEXT NOT NULL',
+            'Rate': 'REAL NOT NULL'
+        },
+        'primary_key': ['RateDate', 'Currency'],
+        'categorical': ['Currency']
+    }
+}
+
+def compact_dtypes(df, table_name):
+    """Convert a warehouse table's frame to the compact dtypes of its schema.
+    
+    Categorical columns become pandas categoricals and INTEGER columns are
+    downcast to the smallest integer type holding their values (nullable
+    if they have missing values). REAL columns stay float64 so stored
+    amounts and the sums computed from them don't change.
+    """
+    schema = WAREHOUSE_SCHEMA[table_name]
+    df = df.copy()
+    for col, col_type in schema['columns'].items():
+        if col not in df.columns:
+            continue
+        if col in schema['categorical']:
+            df[col] = df[col].astype('category')
+        elif col_type.startswith('INTEGER'):
+            values = df[col]
+            if values.isna().any():
+                values = values.astype('Int64')
+            df[col] = pd.to_numeric(values, downcast='integer')
+    return df
+
+def memory_usage(df):
+    """Memory used by a DataFrame in bytes, including the contents of text columns."""
+    return int(df.memory_usage(deep=True).sum())
+
+def memory_report(frames):
+    """Rows and memory (MB) of each frame, keyed by table name."""
+    return {
+        name: {'rows': len(df), 'memory_mb': round(memory_usage(df) / 2**20, 3)}
+        for name, df in frames.items()
+    }
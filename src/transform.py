@@ -1,45 +1,168 @@
+from datetime import date
+import numpy as np
 import pandas as pd
-from config import CITY_FIXES, COUNTRY_FIXES
+from config import REPORTING_CURRENCIES
+from schema import compact_dtypes
+from utils.metrics import instrument
 
-def handle_missing_values(df, placeholder='Unknown'):
-    """Fill missing values in DataFrame with placeholder."""
-    return df.fillna(placeholder)
+# Placeholder filled into missing text values not covered by a policy
+DEFAULT_TEXT_FILL = 'Unknown'
 
-def remove_duplicates(df):
-    """Remove duplicate rows from DataFrame."""
-    duplicate_count = df.duplicated().sum()
-    if duplicate_count > 0:
-        print(f"{duplicate_count} duplicate rows found. Removing them.")
-        return df.drop_duplicates()
-    return df
+# Cleaning policy per source table:
+#   key          - columns identifying a row; duplicates are dropped on these only
+#   fill         - typed fill values for missing values in specific columns;
+#                  other text columns get DEFAULT_TEXT_FILL and other
+#                  non-text columns keep their nulls, so numeric columns
+#                  keep their compact dtypes
+#   dates        - columns parsed to datetimes
+#   categorical  - low-cardinality text columns stored as categoricals
+CLEANING_POLICIES = {
+    'customers': {
+        'key': ['CustomerID'],
+        'categorical': ['City', 'Country', 'Region']
+    },
+    'orders': {
+        'key': ['OrderID'],
+        'fill': {'Freight': 0.0},
+        'dates': ['OrderDate', 'RequiredDate', 'ShippedDate'],
+        'categorical': ['ShipCity', 'ShipCountry', 'ShipRegion']
+    },
+    'order_details': {
+        'key': ['OrderID', 'ProductID'],
+        'fill': {'Discount': 0.0}
+    },
+    'products': {
+        'key': ['ProductID'],
+        'fill': {'Discontinued': 0}
+    },
+    'categories': {
+        'key': ['CategoryID'],
+        'categorical': ['CategoryName']
+    },
+    'suppliers': {
+        'key': ['SupplierID'],
+        'categorical': ['City', 'Country', 'Region']
+    }
+}
 
+def clean_dataframe(df, policy=None):
+    """Clean a DataFrame according to its cleaning policy.
+    
+    Nulls are counted and duplicate keys found in a single pass each.
+    Returns the cleaned DataFrame and its cleaning metrics: input rows,
+    nulls per column, the columns filled and the duplicate rows dropped.
+    """
+    policy = policy or {}
+    null_counts = df.isna().sum()
+    null_columns = null_counts[null_counts > 0]
+    
+    fills = {}
+    for col in null_columns.index:
+        if col in policy.get('fill', {}):
+            fills[col] = policy['fill'][col]
+        elif col in policy.get('dates', []):
+            continue  # parsed below, missing dates stay NaT
+        elif pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            fills[col] = DEFAULT_TEXT_FILL
+    df = df.fillna(fills) if fills else df.copy()
+    
+    for col in policy.get('dates', []):
+        if col in df:
+            df[col] = pd.to_datetime(df[col], format='mixed')
+    for col in policy.get('categorical', []):
+        if col in df:
+            df[col] = df[col].astype('category')
+    
+    key = [col for col in policy.get('key', []) if col in df] or None
+    duplicated = df.duplicated(subset=key)
+    duplicate_count = int(duplicated.sum())
+    if duplicate_count:
+        df = df[~duplicated]
+    
+    metrics = {
+        'rows': len(duplicated),
+        'nulls': {col: int(count) for col, count in null_columns.items()},
+        'filled': list(fills),
+        'duplicates': duplicate_count
+    }
+    return df, metrics
+
+def merge_cleaning_metrics(total, metrics):
+    """Add the cleaning metrics of one chunk to the running totals of a table."""
+    total['rows'] = total.get('rows', 0) + metrics['rows']
+    total['duplicates'] = total.get('duplicates', 0) + metrics['duplicates']
+    nulls = total.setdefault('nulls', {})
+    for col, count in metrics['nulls'].items():
+        nulls[col] = nulls.get(col, 0) + count
+    total['filled'] = sorted(set(total.get('filled', [])) | set(metrics['filled']))
+    return total
+
+@instrument
 def clean_dataframes(dataframes):
-    """Clean all DataFrames by handling missing values and duplicates."""
-    cleaned_dfs = {}
+    """Clean all DataFrames with their table's cleaning policy.
+    
+    Returns the cleaned DataFrames and the cleaning metrics of each table.
+    """
+    cleaned_dfs, metrics = {}, {}
     for name, df in dataframes.items():
-        print(f"\n--- {name} ---")
-        print("Null values before filling:")
-        print(df.isna().sum()[df.isna().sum() > 0])
-        
-        df = handle_missing_values(df)
-        df = remove_duplicates(df)
-        
-        cleaned_dfs[name] = df
-        print(f"{name}: nulls filled and duplicates handled.")
-    return cleaned_dfs
-
-def create_dimensions(tables):
-    """Create dimension tables from source tables."""
-    # dim_customer
-    dim_customer = tables['customers'][[
+        cleaned_dfs[name], metrics[name] = clean_dataframe(df, CLEANING_POLICIES.get(name))
+    return cleaned_dfs, metrics
+
+def assign_surrogate_keys(dim, natural_key, surrogate_key, existing_keys=None):
+    """Add an integer surrogate key column to a dimension.
+    
+    Members already in the warehouse keep their existing key (existing_keys
+    maps natural key to surrogate key); new members get the next free keys.
+    """
+    if existing_keys is None:
+        existing_keys = pd.Series(dtype='int64')
+    keys = dim[natural_key].map(existing_keys)
+    
+    new_members = keys.isna()
+    next_key = int(existing_keys.max()) + 1 if len(existing_keys) else 1
+    keys[new_members] = np.arange(next_key, next_key + new_members.sum())
+    
+    dim.insert(0, surrogate_key, keys.astype('int64'))
+    return dim
+
+def create_date_dimension(order_dates):
+    """Create a calendar dimension covering every day of the order date range."""
+    order_dates = order_dates.dropna()
+    if order_dates.empty:
+        calendar = pd.DatetimeIndex([])
+    else:
+        calendar = pd.date_range(order_dates.min().normalize(), order_dates.max().normalize(), freq='D')
+    
+    return pd.DataFrame({
+        'DateKey': calendar.year * 10000 + calendar.month * 100 + calendar.day,
+        'FullDate': calendar.strftime('%Y-%m-%d'),
+        'Year': calendar.year,
+        'Quarter': calendar.quarter,
+        'Month': calendar.month,
+        'Day': calendar.day,
+        'Weekday': calendar.dayofweek + 1  # ISO weekday, Monday = 1
+    })
+
+def date_keys(dates):
+    """Convert datetimes to YYYYMMDD integer date keys."""
+    return dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+
+@instrument
+def create_customer_dimension(customers, existing_keys=None):
+    """Create the customer dimension, before its geographic enrichment."""
+    dim_customer = customers[[
         'CustomerID', 'CompanyName', 'ContactName', 'City', 'Country'
     ]].copy()
-    
-    # dim_product
-    dim_product = tables['products'].merge(
-        tables['categories'], on='CategoryID', how='left'
+    dim_customer = assign_surrogate_keys(dim_customer, 'CustomerID', 'CustomerKey', existing_keys)
+    return compact_dtypes(dim_customer, 'dim_customer')
+
+@instrument
+def create_product_dimension(products, categories, suppliers, existing_keys=None):
+    """Create the product dimension from products, their categories and suppliers."""
+    dim_product = products.merge(
+        categories, on='CategoryID', how='left'
     ).merge(
-        tables['suppliers'], on='SupplierID', how='left'
+        suppliers, on='SupplierID', how='left'
     )
     
     dim_product = dim_product[[
@@ -48,65 +171,161 @@ def create_dimensions(tables):
         'CompanyName': 'SupplierName',
         'Country': 'SupplierCountry'
     })
+    dim_product = assign_surrogate_keys(dim_product, 'ProductID', 'ProductKey', existing_keys)
+    return compact_dtypes(dim_product, 'dim_product')
+
+@instrument
+def create_order_date_dimension(orders):
+    """Create the date dimension covering the orders' date range."""
+    order_dates = pd.to_datetime(orders['OrderDate'], format='mixed')
+    return compact_dtypes(create_date_dimension(order_dates), 'dim_date')
+
+@instrument
+def create_dimensions(tables, existing_keys=None):
+    """Create dimension tables from source tables.
     
-    # dim_date
-    tables['orders']['OrderDate'] = pd.to_datetime(tables['orders']['OrderDate'], format='mixed')
-    dim_date = tables['orders'][['OrderID', 'OrderDate']].copy()
-    dim_date['Year'] = dim_date['OrderDate'].dt.year
-    dim_date['Month'] = dim_date['OrderDate'].dt.month
-    dim_date['Day'] = dim_date['OrderDate'].dt.day
-    
+    existing_keys maps dimension names to the natural-to-surrogate key
+    mapping already in the warehouse, so keys stay stable between runs.
+    """
+    existing_keys = existing_keys or {}
     return {
-        'dim_customer': dim_customer,
-        'dim_product': dim_product,
-        'dim_date': dim_date
+        'dim_customer': create_customer_dimension(tables['customers'], existing_keys.get('dim_customer')),
+        'dim_product': create_product_dimension(
+            tables['products'], tables['categories'], tables['suppliers'],
+            existing_keys.get('dim_product')
+        ),
+        'dim_date': create_order_date_dimension(tables['orders'])
     }
 
-def create_fact_table(tables):
-    """Create fact table from source tables."""
-    fact_sales = tables['order_details'].merge(
-        tables['orders'][['OrderID', 'CustomerID', 'OrderDate']], 
-        on='OrderID', how='left'
-    ).merge(
-        tables['products'][['ProductID', 'ProductName']], 
-        on='ProductID', how='left'
-    )
+FACT_COLUMNS = [
+    'OrderID', 'CustomerID', 'ProductID', 'OrderDate',
+    'CustomerKey', 'ProductKey', 'DateKey',
+    'Quantity', 'UnitPrice', 'Discount', 'RevenueUSD'
+] + [f'Revenue{currency}' for currency in REPORTING_CURRENCIES]
+
+@instrument
+def clean_chunks(chunks, table_name='order_details', metrics=None):
+    """Clean each streamed chunk with its table's cleaning policy.
     
-    fact_sales['OrderDate'] = pd.to_datetime(fact_sales['OrderDate'])
+    The cleaning metrics of every chunk are added up into metrics as the
+    chunks are consumed. Duplicates are only detected within a chunk.
+    """
+    policy = CLEANING_POLICIES.get(table_name)
+    for chunk in chunks:
+        chunk, chunk_metrics = clean_dataframe(chunk, policy)
+        if metrics is not None:
+            merge_cleaning_metrics(metrics, chunk_metrics)
+        yield chunk
+
+def build_order_lookup(orders):
+    """Index orders by OrderID for joining order detail chunks."""
+    order_lookup = orders[['OrderID', 'CustomerID', 'OrderDate']].drop_duplicates('OrderID')
+    order_lookup = order_lookup.set_index('OrderID')
+    order_lookup['OrderDate'] = pd.to_datetime(order_lookup['OrderDate'], format='mixed')
+    return order_lookup
+
+@instrument
+def create_exchange_rate_dimension(exchange_rates, history, rate_date=None):
+    """Append today's exchange rates to the rate history recorded so far."""
+    rate_date = (rate_date or date.today()).isoformat()
+    todays_rates = pd.DataFrame({
+        'RateDate': rate_date,
+        'Currency': list(exchange_rates.keys()),
+        'Rate': list(exchange_rates.values())
+    })
+    
+    dim_exchange_rate = pd.concat([history, todays_rates], ignore_index=True)
+    dim_exchange_rate = dim_exchange_rate.drop_duplicates(['RateDate', 'Currency'], keep='last')
+    dim_exchange_rate = dim_exchange_rate.sort_values(['Currency', 'RateDate']).reset_index(drop=True)
+    return compact_dtypes(dim_exchange_rate, 'dim_exchange_rate')
+
+def build_exchange_rate_lookup(dim_exchange_rate):
+    """Index rate history by currency as sorted (dates, rates) arrays."""
+    exchange_rate_lookup = {}
+    for currency, rates in dim_exchange_rate.groupby('Currency'):
+        rates = rates.sort_values('RateDate')
+        dates = pd.to_datetime(rates['RateDate']).to_numpy(dtype='datetime64[ns]')
+        exchange_rate_lookup[currency] = (dates, rates['Rate'].to_numpy(dtype=float))
+    return exchange_rate_lookup
+
+@instrument
+def add_currency_columns(fact_sales, exchange_rate_lookup):
+    """Convert RevenueUSD into each reporting currency at the order date's rate.
+    
+    Each order uses the latest rate recorded on or before its order date;
+    orders older than the rate history use the earliest recorded rate.
+    """
+    order_dates = fact_sales['OrderDate'].to_numpy(dtype='datetime64[ns]')
+    for currency in REPORTING_CURRENCIES:
+        dates, rates = exchange_rate_lookup[currency]
+        positions = np.searchsorted(dates, order_dates, side='right') - 1
+        fact_sales[f'Revenue{currency}'] = fact_sales['RevenueUSD'] * rates[positions.clip(0)]
+    return fact_sales
+
+def build_key_lookup(dim, natural_key, surrogate_key):
+    """Index a dimension's surrogate keys by natural key."""
+    return dim.drop_duplicates(natural_key).set_index(natural_key)[surrogate_key]
+
+@instrument
+def create_fact_table(order_details, order_lookup, exchange_rate_lookup, key_lookups):
+    """Create fact rows, with revenue in every reporting currency, from order details."""
+    fact_sales = order_details.join(order_lookup, on='OrderID')
+    fact_sales['CustomerKey'] = fact_sales['CustomerID'].map(key_lookups['CustomerKey'])
+    fact_sales['ProductKey'] = fact_sales['ProductID'].map(key_lookups['ProductKey'])
+    fact_sales['DateKey'] = date_keys(fact_sales['OrderDate'])
     fact_sales['RevenueUSD'] = fact_sales['UnitPrice'] * fact_sales['Quantity']
+    fact_sales = add_currency_columns(fact_sales, exchange_rate_lookup)
+    
+    return compact_dtypes(fact_sales[FACT_COLUMNS], 'fact_sales')
+
+def build_fact_lookups(orders, dimensions):
+    """Build the orders, exchange rate and surrogate key lookups of create_fact_table.
     
-    return fact_sales[[
-        'OrderID', 'CustomerID', 'ProductID', 'OrderDate', 
-        'Quantity', 'UnitPrice', 'Discount', 'RevenueUSD'
-    ]]
+    Returns them as create_fact_table's keyword arguments.
+    """
+    return {
+        'order_lookup': build_order_lookup(orders),
+        'exchange_rate_lookup': build_exchange_rate_lookup(dimensions['dim_exchange_rate']),
+        'key_lookups': {
+            'CustomerKey': build_key_lookup(dimensions['dim_customer'], 'CustomerID', 'CustomerKey'),
+            'ProductKey': build_key_lookup(dimensions['dim_product'], 'ProductID', 'ProductKey')
+        }
+    }
 
-def enrich_customer_dimension(dim_customer, world_cities):
-    """Enrich customer dimension with additional geographic data."""
-    # Create lowercase versions for matching
-    dim_customer['City_lower'] = dim_customer['City'].str.lower()
-    dim_customer['Country_lower'] = dim_customer['Country'].str.lower()
-    world_cities['city_lower'] = world_cities['city'].str.lower()
-    world_cities['country_lower'] = world_cities['country'].str.lower()
+@instrument
+def create_fact_chunks(order_detail_chunks, tables, dimensions):
+    """Yield fact table chunks built from streamed order details.
     
-    # Apply fixes to standardized city and country columns
-    dim_customer['City_lower'] = dim_customer['City_lower'].replace(CITY_FIXES)
-    dim_customer['Country_lower'] = dim_customer['Country_lower'].replace(COUNTRY_FIXES)
+    Only the orders, surrogate key and exchange rate lookups are held in
+    memory; each order details chunk is joined against them and converted
+    to fact rows independently.
+    """
+    lookups = build_fact_lookups(tables['orders'], dimensions)
+    for order_details in order_detail_chunks:
+        yield create_fact_table(order_details, **lookups)
+
+@instrument
+def enrich_customer_dimension(dim_customer, city_matches):
+    """Enrich customer dimension with additional geographic data.
     
-    # Join with world cities data
+    city_matches holds the world city matched to each customer (City,
+    Country) address, as returned by geo_match.match_cities.
+    """
     enriched_customer = dim_customer.merge(
-        world_cities,
-        left_on=['City_lower', 'Country_lower'],
-        right_on=['city_lower', 'country_lower'],
+        city_matches,
+        on=['City', 'Country'],
         how='left'
     )
     
     # Select and rename final columns
-    return enriched_customer[[
-        'CustomerID', 'CompanyName', 'ContactName', 'City', 'Country',
+    enriched_customer = enriched_customer[[
+        'CustomerKey', 'CustomerID', 'CompanyName', 'ContactName', 'City', 'Country',
         'admin_name', 'lat', 'lng', 'population'
     ]].rename(columns={
         'admin_name': 'Region',
         'lat': 'Latitude',
         'lng': 'Longitude',
         'population': 'CityPopulation'
-    }) 
\ No newline at end of file
+    })
+    
+    return compact_dtypes(enriched_customer, 'dim_customer') 
\ No newline at end of file
@@ -0,0 +1,169 @@
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+from config import CHECKPOINT_DIR, CHECKPOINT_KEEP_RUNS
+
+MANIFEST_NAME = "manifest.json"
+
+def write_manifest(run_dir, manifest):
+    """Atomically write a run's manifest."""
+    path = run_dir / MANIFEST_NAME
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, path)
+
+def read_manifest(run_dir):
+    """Read a run's manifest, or None if it has none."""
+    try:
+        return json.loads((run_dir / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+
+def write_artifact(path, value):
+    """Write a task output next to path, returning the file name used.
+    
+    DataFrames are written as Parquet; other outputs, and frames Parquet
+    can't represent (e.g. mixed-type object columns), are pickled. The file
+    is written under a temporary name and moved into place.
+    """
+    if isinstance(value, pd.DataFrame):
+        target = path.with_suffix('.parquet')
+        tmp_path = target.with_name(target.name + ".tmp")
+        try:
+            value.to_parquet(tmp_path)
+            os.replace(tmp_path, target)
+            return target.name
+        except (pa.ArrowException, ValueError):
+            tmp_path.unlink(missing_ok=True)
+    
+    target = path.with_suffix('.pickle')
+    tmp_path = target.with_name(target.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, target)
+    return target.name
+
+def read_artifact(path):
+    """Read a task output written by write_artifact."""
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def reset_directory(directory):
+    """Empty a directory, creating it if needed."""
+    directory = Path(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+
+def write_parquet_chunks(chunks, directory, partition=None):
+    """Write DataFrame chunks as numbered Parquet files in a directory.
+    
+    Anything already in the directory is removed first, so a retried
+    writer starts over. Writers of several partitions of the same data
+    pass their partition number instead and write next to each other into
+    a directory reset beforehand; the files are numbered by partition,
+    then chunk. Returns the number of rows written.
+    """
+    directory = Path(directory)
+    if partition is None:
+        reset_directory(directory)
+    row_count = 0
+    for number, chunk in enumerate(chunks):
+        if chunk.empty:
+            continue
+        chunk.to_parquet(directory / f"part-{partition or 0:05d}-{number:05d}.parquet")
+        row_count += len(chunk)
+    return row_count
+
+def read_parquet_chunks(directory):
+    """Yield the DataFrame chunks written by write_parquet_chunks, in partition and chunk order."""
+    for path in sorted(Path(directory).glob("part-*.parquet")):
+        yield pd.read_parquet(path)
+
+class RunCheckpoint:
+    """Task outputs of one ETL run, persisted under CHECKPOINT_DIR/<run id>.
+    
+    Used as the outputs of utils.task_runner.run_tasks: each output is
+    written to disk as soon as its task finishes (DataFrames as Parquet,
+    anything else pickled) and recorded in the run's manifest, so a
+    failed run can be resumed by another process. Outputs are read back
+    lazily and kept in memory once read.
+    """
+    
+    def __init__(self, run_dir):
+        self.run_dir = Path(run_dir)
+        self.manifest = read_manifest(self.run_dir)
+        if self.manifest is None:
+            raise ValueError(f"No checkpoint in {self.run_dir}")
+        self.values = {}
+    
+    @classmethod
+    def create(cls, full_refresh=False, checkpoint_dir=CHECKPOINT_DIR):
+        """Start the checkpoint of a new run, identified by its start time."""
+        run_id = f"{datetime.now():%Y%m%d_%H%M%S_%f}"
+        run_dir = Path(checkpoint_dir) / run_id
+        run_dir.mkdir(parents=True)
+        write_manifest(run_dir, {
+            'run_id': run_id,
+            'created_at': datetime.now().isoformat(),
+            'full_refresh': full_refresh,
+            'status': 'running',
+            'artifacts': {}
+        })
+        return cls(run_dir)
+    
+    @classmethod
+    def latest_unfinished(cls, checkpoint_dir=CHECKPOINT_DIR):
+        """The checkpoint of the latest run if it didn't complete, else None."""
+        for run_dir in sorted(Path(checkpoint_dir).glob("*"), reverse=True):
+            manifest = read_manifest(run_dir)
+            if manifest is not None:
+                return cls(run_dir) if manifest['status'] != 'complete' else None
+        return None
+    
+    @property
+    def run_id(self):
+        return self.manifest['run_id']
+    
+    @property
+    def full_refresh(self):
+        return self.manifest['full_refresh']
+    
+    def __contains__(self, name):
+        return name in self.manifest['artifacts']
+    
+    def __getitem__(self, name):
+        if name not in self.values:
+            if name not in self:
+                raise KeyError(name)
+            self.values[name] = read_artifact(self.run_dir / self.manifest['artifacts'][name])
+        return self.values[name]
+    
+    def __setitem__(self, name, value):
+        self.manifest['artifacts'][name] = write_artifact(self.run_dir / name, value)
+        write_manifest(self.run_dir, self.manifest)
+        self.values[name] = value
+    
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+    
+    def path(self, name):
+        """Path in the run's directory for an artifact a task writes itself."""
+        return self.run_dir / name
+    
+    def set_status(self, status):
+        """Record the run's status: running, failed or complete."""
+        self.manifest['status'] = status
+        write_manifest(self.run_dir, self.manifest)
+
+def prune_checkpoints(keep=CHECKPOINT_KEEP_RUNS, checkpoint_dir=CHECKPOINT_DIR):
+    """Delete the checkpoints of all but the latest keep runs."""
+    run_dirs = sorted(path for path in Path(checkpoint_dir).glob("*") if path.is_dir())
+    for run_dir in run_dirs[:-keep] if keep else run_dirs:
+        shutil.rmtree(run_dir, ignore_errors=True)
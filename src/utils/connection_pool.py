@@ -0,0 +1,87 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import sys
+
+# Add src directory to Python path
+src_path = Path(__file__).parent.parent
+sys.path.append(str(src_path))
+
+from config import SQLITE_DB, CONNECTION_POOL_SIZE, CONNECTION_POOL_TIMEOUT, CONNECTION_MMAP_SIZE
+
+# Settings applied to every pooled connection when it is opened
+POOL_PRAGMAS = {
+    'cache_size': -64000,  # ~64 MB
+    'mmap_size': CONNECTION_MMAP_SIZE,
+    'temp_store': 'MEMORY',
+    'busy_timeout': CONNECTION_POOL_TIMEOUT * 1000
+}
+
+class ConnectionPool:
+    """Thread-safe pool of reusable SQLite connections to one database.
+    
+    Connections are opened lazily, up to size at a time, and kept open
+    between uses so their page cache and memory map stay warm. They are
+    created with check_same_thread=False; the pool hands each one to a
+    single thread at a time.
+    """
+    
+    def __init__(self, db_path, size=CONNECTION_POOL_SIZE, read_only=True):
+        self.db_path = Path(db_path)
+        self.read_only = read_only
+        self.idle = queue.LifoQueue()  # most recently used first, as its cache is warmest
+        self.slots = threading.BoundedSemaphore(size)
+    
+    def connect(self):
+        """Open and configure a new connection."""
+        if self.read_only:
+            uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=CONNECTION_POOL_TIMEOUT)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=CONNECTION_POOL_TIMEOUT)
+        for pragma, value in POOL_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block."""
+        if not self.slots.acquire(timeout=CONNECTION_POOL_TIMEOUT):
+            raise TimeoutError(f"No free connection to {self.db_path} after {CONNECTION_POOL_TIMEOUT}s")
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+            try:
+                yield conn
+            finally:
+                # Never hand an open transaction to the next borrower
+                if conn.in_transaction:
+                    conn.rollback()
+                self.idle.put(conn)
+        finally:
+            self.slots.release()
+    
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+# Process-wide pools by (database, read_only)
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(db_path=SQLITE_DB, read_only=True):
+    """Return the process-wide connection pool for a database, creating it on first use."""
+    key = (str(db_path), read_only)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(db_path, read_only=read_only)
+        return pools[key]
@@ -1,4 +1,3 @@
-import sqlite3
 from datetime import datetime
 from pathlib import Path
 import sys
@@ -7,92 +6,272 @@ import sys
 src_path = Path(__file__).parent.parent
 sys.path.append(str(src_path))
 
-from config import SQLITE_DB
+from utils.connection_pool import get_pool
 
 def init_job_metadata():
     """Initialize the job metadata table."""
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-    
-    # Create job metadata table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS job_metadata (
-        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        job_name TEXT NOT NULL,
-        start_time TIMESTAMP NOT NULL,
-        end_time TIMESTAMP,
-        status TEXT,
-        error_message TEXT,
-        duration_seconds REAL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        # WAL lets the dashboard keep reading while the ETL writes
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        # Create job metadata table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_metadata (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_name TEXT NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP,
+            status TEXT,
+            error_message TEXT,
+            duration_seconds REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Job history is read by job name over a time range
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_job_metadata_name_start
+        ON job_metadata (job_name, start_time)
+        ''')
+        
+        # Create high-water mark table used by incremental runs
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS etl_watermark (
+            source_name TEXT PRIMARY KEY,
+            max_order_id INTEGER NOT NULL,
+            max_order_date TIMESTAMP NOT NULL,
+            job_id INTEGER REFERENCES job_metadata(job_id),
+            updated_at TIMESTAMP NOT NULL
+        )
+        ''')
+        
+        # Create source fingerprint table used to detect unchanged inputs
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS source_fingerprint (
+            job_id INTEGER NOT NULL REFERENCES job_metadata(job_id),
+            source_name TEXT NOT NULL,
+            row_count INTEGER,
+            content_hash TEXT NOT NULL,
+            recorded_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (job_id, source_name)
+        )
+        ''')
+        
+        # Create per-OrderID-range fingerprint table of the order sources,
+        # holding the ranges recorded by the last successful load only
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS source_range_fingerprint (
+            source_name TEXT NOT NULL,
+            range_number INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            job_id INTEGER NOT NULL REFERENCES job_metadata(job_id),
+            PRIMARY KEY (source_name, range_number)
+        )
+        ''')
+        
+        # Create per-step metrics table recorded by instrumented functions
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_step_metrics (
+            job_id INTEGER NOT NULL REFERENCES job_metadata(job_id),
+            step_name TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            wall_seconds REAL,
+            cpu_seconds REAL,
+            rows_in INTEGER,
+            rows_out INTEGER,
+            peak_memory_mb REAL,
+            PRIMARY KEY (job_id, step_name)
+        )
+        ''')
+        
+        conn.commit()
 
 def log_job_start(job_name):
     """Log the start of a job."""
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO job_metadata (job_name, start_time, status)
-    VALUES (?, ?, ?)
-    ''', (job_name, datetime.now(), 'running'))
-    
-    job_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return job_id
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT INTO job_metadata (job_name, start_time, status)
+        VALUES (?, ?, ?)
+        ''', (job_name, datetime.now(), 'running'))
+        
+        job_id = cursor.lastrowid
+        conn.commit()
+        
+        return job_id
 
 def log_job_end(job_id, status, error_message=None):
     """Log the end of a job."""
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-    
-    # Get start time
-    cursor.execute('SELECT start_time FROM job_metadata WHERE job_id = ?', (job_id,))
-    start_time = datetime.fromisoformat(cursor.fetchone()[0])
-    
-    # Calculate duration
-    end_time = datetime.now()
-    duration = (end_time - start_time).total_seconds()
-    
-    # Update job record
-    cursor.execute('''
-    UPDATE job_metadata 
-    SET end_time = ?, status = ?, error_message = ?, duration_seconds = ?
-    WHERE job_id = ?
-    ''', (end_time, status, error_message, duration, job_id))
-    
-    conn.commit()
-    conn.close()
-    
-    return duration
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        # Get start time
+        cursor.execute('SELECT start_time FROM job_metadata WHERE job_id = ?', (job_id,))
+        start_time = datetime.fromisoformat(cursor.fetchone()[0])
+        
+        # Calculate duration
+        end_time = datetime.now()
+        duration = (end_time - start_time).total_seconds()
+        
+        # Update job record
+        cursor.execute('''
+        UPDATE job_metadata 
+        SET end_time = ?, status = ?, error_message = ?, duration_seconds = ?
+        WHERE job_id = ?
+        ''', (end_time, status, error_message, duration, job_id))
+        
+        conn.commit()
+        
+        return duration
 
 def get_job_history(job_name=None, limit=10):
     """Get the execution history of jobs."""
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-    
-    query = '''
-    SELECT job_id, job_name, start_time, end_time, status, error_message, duration_seconds
-    FROM job_metadata
-    '''
-    
-    if job_name:
-        query += ' WHERE job_name = ?'
-        cursor.execute(query + ' ORDER BY start_time DESC LIMIT ?', (job_name, limit))
-    else:
-        cursor.execute(query + ' ORDER BY start_time DESC LIMIT ?', (limit,))
-    
-    # Convert tuples to dictionaries
-    columns = ['job_id', 'job_name', 'start_time', 'end_time', 'status', 'error_message', 'duration']
-    results = []
-    for row in cursor.fetchall():
-        results.append(dict(zip(columns, row)))
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        query = '''
+        SELECT job_id, job_name, start_time, end_time, status, error_message, duration_seconds
+        FROM job_metadata
+        '''
+        
+        if job_name:
+            query += ' WHERE job_name = ?'
+            cursor.execute(query + ' ORDER BY start_time DESC LIMIT ?', (job_name, limit))
+        else:
+            cursor.execute(query + ' ORDER BY start_time DESC LIMIT ?', (limit,))
+        
+        # Convert tuples to dictionaries
+        columns = ['job_id', 'job_name', 'start_time', 'end_time', 'status', 'error_message', 'duration']
+        results = []
+        for row in cursor.fetchall():
+            results.append(dict(zip(columns, row)))
+        
+        return results 
+
+def get_high_water_mark(source_name='orders'):
+    """Get the high-water mark recorded by the last successful load."""
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT max_order_id, max_order_date, job_id, updated_at
+        FROM etl_watermark
+        WHERE source_name = ?
+        ''', (source_name,))
+        row = cursor.fetchone()
+        
+        if row is None:
+            return None
+        columns = ['max_order_id', 'max_order_date', 'job_id', 'updated_at']
+        return dict(zip(columns, row))
+
+def set_high_water_mark(max_order_id, max_order_date, job_id, source_name='orders'):
+    """Record the high-water mark reached by a successful load."""
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT OR REPLACE INTO etl_watermark (source_name, max_order_id, max_order_date, job_id, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (source_name, int(max_order_id), str(max_order_date), job_id, datetime.now()))
+        
+        conn.commit()
+
+def record_source_fingerprints(job_id, fingerprints):
+    """Record the fingerprints of the source inputs loaded by a successful job.
     
-    conn.close()
-    return results 
\ No newline at end of file
+    The OrderID range fingerprints of the order sources replace those
+    recorded by the previous load.
+    """
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        recorded_at = datetime.now()
+        cursor.executemany('''
+        INSERT OR REPLACE INTO source_fingerprint (job_id, source_name, row_count, content_hash, recorded_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (job_id, name, fingerprint['row_count'], fingerprint['content_hash'], recorded_at)
+            for name, fingerprint in fingerprints.items()
+        ])
+        
+        for name, fingerprint in fingerprints.items():
+            if 'ranges' not in fingerprint:
+                continue
+            cursor.execute('DELETE FROM source_range_fingerprint WHERE source_name = ?', (name,))
+            cursor.executemany('''
+            INSERT INTO source_range_fingerprint (source_name, range_number, row_count, content_hash, job_id)
+            VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (name, number, row_count, content_hash, job_id)
+                for number, (row_count, content_hash) in fingerprint['ranges'].items()
+            ])
+        
+        conn.commit()
+
+def get_source_fingerprints():
+    """Get the source fingerprints recorded by the last successful load."""
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT source_name, row_count, content_hash
+        FROM source_fingerprint
+        WHERE job_id = (SELECT MAX(job_id) FROM source_fingerprint)
+        ''')
+        
+        return {
+            name: {'row_count': row_count, 'content_hash': content_hash}
+            for name, row_count, content_hash in cursor.fetchall()
+        }
+
+def get_source_range_fingerprints():
+    """Get the OrderID range fingerprints recorded by the last successful load, by source."""
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT source_name, range_number, row_count, content_hash
+        FROM source_range_fingerprint
+        ''')
+        
+        ranges = {}
+        for name, number, row_count, content_hash in cursor.fetchall():
+            ranges.setdefault(name, {})[number] = (row_count, content_hash)
+        return ranges
+
+def record_step_metrics(job_id, steps):
+    """Record the metrics of the steps a job ran, as collected by utils.metrics."""
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+        INSERT OR REPLACE INTO job_step_metrics
+            (job_id, step_name, calls, wall_seconds, cpu_seconds, rows_in, rows_out, peak_memory_mb)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (job_id, name, metrics['calls'], metrics['wall_seconds'], metrics['cpu_seconds'],
+             metrics['rows_in'], metrics['rows_out'], metrics['peak_memory_mb'])
+            for name, metrics in steps.items()
+        ])
+        
+        conn.commit()
+
+def get_step_metrics(job_id):
+    """Get the step metrics recorded for a job, slowest step first."""
+    with get_pool(read_only=False).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT step_name, calls, wall_seconds, cpu_seconds, rows_in, rows_out, peak_memory_mb
+        FROM job_step_metrics
+        WHERE job_id = ?
+        ORDER BY wall_seconds DESC
+        ''', (job_id,))
+        
+        columns = ['step_name', 'calls', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'peak_memory_mb']
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
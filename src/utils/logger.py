@@ -13,8 +13,12 @@ logger.add(
     format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
     level="INFO"
 )
+# The file is only created once something is logged, so processes that
+# import this module without logging (e.g. fact transform workers) don't
+# leave empty log files behind
 logger.add(
     logs_dir / "etl_{time}.log",
+    delay=True,
     rotation="1 day",
     retention="7 days",
     format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
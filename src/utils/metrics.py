@@ -0,0 +1,245 @@
+import functools
+import inspect
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+# Step metrics of the job being measured, by step name; None while no job
+# collects them, in which case instrumented functions only run
+collector = None
+collector_lock = threading.Lock()
+
+# The steps open on each thread, to which the CPU time of worker processes
+# they wait for is added
+open_steps = threading.local()
+
+# Seconds between samples of the memory in use while steps are watched
+MEMORY_SAMPLE_SECONDS = 0.02
+
+# Memory watches of the running steps, by id, and the thread sampling the
+# memory for them while any is running
+memory_watches = {}
+memory_lock = threading.Lock()
+memory_sampler = None
+
+def count_rows(value):
+    """Rows held by a DataFrame or Series, or by a dict, list or tuple of them; else None."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        counts = [count_rows(item) for item in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    return None
+
+def count_rows_in(args, kwargs):
+    """Rows of a call's input: those of its first argument holding DataFrames."""
+    for value in [*args, *kwargs.values()]:
+        rows = count_rows(value)
+        if rows is not None:
+            return rows
+    return None
+
+def peak_memory_mb():
+    """Peak resident memory of the process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def current_memory_mb():
+    """Resident memory of the process now, in MB.
+    
+    Without /proc (e.g. on macOS) this is the peak so far, so a step only
+    shows the memory by which it raised that peak.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except OSError:
+        return peak_memory_mb()
+    return pages * resource.getpagesize() / 2**20
+
+def sample_memory():
+    """Raise the peaks of the memory watches to the memory in use, until none is left."""
+    global memory_sampler
+    while True:
+        time.sleep(MEMORY_SAMPLE_SECONDS)
+        memory_mb = current_memory_mb()
+        with memory_lock:
+            if not memory_watches:
+                memory_sampler = None
+                return
+            for watch in memory_watches.values():
+                watch['peak_mb'] = max(watch['peak_mb'], memory_mb)
+
+def watch_memory():
+    """Start watching the memory in use, sampling it until the watch is ended."""
+    global memory_sampler
+    memory_mb = current_memory_mb()
+    watch = {'start_mb': memory_mb, 'peak_mb': memory_mb}
+    with memory_lock:
+        memory_watches[id(watch)] = watch
+        if memory_sampler is None:
+            memory_sampler = threading.Thread(target=sample_memory, name='memory-sampler', daemon=True)
+            memory_sampler.start()
+    return watch
+
+def end_memory_watch(watch):
+    """Stop a memory watch and return the peak memory in use above that at its start, in MB.
+    
+    The memory is the process's: steps running at the same time in other
+    threads add to each other's peaks.
+    """
+    memory_mb = current_memory_mb()
+    with memory_lock:
+        del memory_watches[id(watch)]
+        peak_mb = max(watch['peak_mb'], memory_mb)
+    return peak_mb - watch['start_mb']
+
+def start_step_metrics():
+    """Start collecting the metrics of instrumented steps for a new job.
+    
+    Returns the dict the metrics are collected into, by step name.
+    """
+    global collector
+    with collector_lock:
+        collector = {}
+        return collector
+
+def finish_step_metrics():
+    """Stop collecting step metrics and return those collected."""
+    global collector
+    with collector_lock:
+        steps, collector = collector, None
+    return steps or {}
+
+def empty_step_metrics():
+    """Metrics of a step not run yet."""
+    return {
+        'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': None, 'rows_out': None,
+        'peak_memory_mb': None
+    }
+
+def record_step(name, wall_seconds, cpu_seconds, rows_in=None, rows_out=None, memory_mb=None):
+    """Add one run of a step to the metrics being collected.
+    
+    Repeated runs of a step (e.g. once per chunk) are added up; the peak
+    memory is the largest memory_mb a run used above that at its start.
+    """
+    with collector_lock:
+        if collector is None:
+            return
+        metrics = collector.setdefault(name, empty_step_metrics())
+        metrics['calls'] += 1
+        metrics['wall_seconds'] += wall_seconds
+        metrics['cpu_seconds'] += cpu_seconds
+        if rows_in is not None:
+            metrics['rows_in'] = (metrics['rows_in'] or 0) + rows_in
+        if rows_out is not None:
+            metrics['rows_out'] = (metrics['rows_out'] or 0) + rows_out
+        if memory_mb is not None:
+            metrics['peak_memory_mb'] = max(metrics['peak_memory_mb'] or 0.0, memory_mb)
+
+def merge_step_metrics(steps, cpu_seconds=0.0):
+    """Add the step metrics collected by a worker process to those being collected.
+    
+    The worker's CPU time, cpu_seconds, is added to the steps open on the
+    calling thread, which waited for the worker.
+    """
+    for metrics in getattr(open_steps, 'steps', []):
+        metrics['worker_cpu_seconds'] += cpu_seconds
+    with collector_lock:
+        if collector is None:
+            return
+        for name, worker_metrics in steps.items():
+            metrics = collector.setdefault(name, empty_step_metrics())
+            for key in ('calls', 'wall_seconds', 'cpu_seconds'):
+                metrics[key] += worker_metrics[key]
+            for key in ('rows_in', 'rows_out'):
+                if worker_metrics[key] is not None:
+                    metrics[key] = (metrics[key] or 0) + worker_metrics[key]
+            if worker_metrics['peak_memory_mb'] is not None:
+                metrics['peak_memory_mb'] = max(metrics['peak_memory_mb'] or 0.0, worker_metrics['peak_memory_mb'])
+
+@contextmanager
+def step(name, rows_in=None):
+    """Measure the code of a with block as a step.
+    
+    Yields a dict in which the block can set rows_in and rows_out. CPU time
+    is that of the calling thread, plus that of the worker processes whose
+    metrics it merged.
+    """
+    metrics = {'rows_in': rows_in, 'rows_out': None, 'worker_cpu_seconds': 0.0}
+    if not hasattr(open_steps, 'steps'):
+        open_steps.steps = []
+    open_steps.steps.append(metrics)
+    watch = watch_memory()
+    start_wall, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield metrics
+    finally:
+        open_steps.steps.remove(metrics)
+        record_step(
+            name, time.perf_counter() - start_wall,
+            time.thread_time() - start_cpu + metrics['worker_cpu_seconds'],
+            metrics['rows_in'], metrics['rows_out'], end_memory_watch(watch)
+        )
+
+def instrumented_generator(name, generator, rows_in):
+    """Yield from a generator, measuring the time spent producing its items as a step.
+    
+    The step is recorded once the generator is exhausted or closed; its time
+    includes that of any generators it pulls from, and its memory is watched
+    from the first item to the last.
+    """
+    wall_seconds = cpu_seconds = 0.0
+    rows_out = 0
+    watch = watch_memory()
+    try:
+        while True:
+            start_wall, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                wall_seconds += time.perf_counter() - start_wall
+                cpu_seconds += time.thread_time() - start_cpu
+            rows_out += count_rows(item) or 0
+            yield item
+    finally:
+        record_step(name, wall_seconds, cpu_seconds, rows_in, rows_out, end_memory_watch(watch))
+
+def instrument(func=None, name=None):
+    """Decorator measuring every call of a function as a step named module.function.
+    
+    Records wall time, CPU time, the rows of the first DataFrame argument
+    and the rows returned (or yielded, for generator functions). Calls made
+    while no job collects metrics are not measured.
+    """
+    def decorate(func):
+        step_name = name or f"{func.__module__}.{func.__name__}"
+    
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if collector is None:
+                    return func(*args, **kwargs)
+                return instrumented_generator(step_name, func(*args, **kwargs), count_rows_in(args, kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if collector is None:
+                    return func(*args, **kwargs)
+                with step(step_name, count_rows_in(args, kwargs)) as metrics:
+                    result = func(*args, **kwargs)
+                    metrics['rows_out'] = count_rows(result)
+                return result
+        return wrapper
+    
+    return decorate(func) if func is not None else decorate
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import sys
+
+# Add src directory to Python path
+src_path = Path(__file__).parent.parent
+sys.path.append(str(src_path))
+
+from config import QUERY_CACHE_MAX_BYTES
+from schema import memory_usage
+
+class QueryCache:
+    """Thread-safe LRU cache of query result DataFrames, bounded by memory.
+    
+    Every entry belongs to a warehouse version (e.g. the id of the last
+    successful load); a lookup with a different version discards all
+    entries, so results are reused until the warehouse is reloaded and
+    never after. Cached frames are shared between callers and must not be
+    modified in place.
+    """
+    
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (frame, bytes), least recently used first
+        self.total_bytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def invalidate(self, version=None):
+        """Drop every entry and start caching results of a new version."""
+        self.entries.clear()
+        self.total_bytes = 0
+        self.version = version
+    
+    def get_or_run(self, key, version, run):
+        """Return the cached result for key, or run() it and cache the result.
+        
+        The query runs outside the lock so other callers aren't blocked;
+        its result is only cached if the version didn't change meanwhile.
+        """
+        with self.lock:
+            if version != self.version:
+                self.invalidate(version)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        
+        result = run()
+        size = memory_usage(result)
+        with self.lock:
+            if version == self.version and size <= self.max_bytes and key not in self.entries:
+                self.entries[key] = (result, size)
+                self.total_bytes += size
+                # Evict least recently used results beyond the memory cap
+                while self.total_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted_size
+        return result
+    
+    def stats(self):
+        """Entries, memory used and hit counts of the cache."""
+        with self.lock:
+            return {
+                'version': self.version,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from loguru import logger
+from config import TASK_WORKERS, TASK_RETRIES, TASK_RETRY_DELAY
+from utils.metrics import step, count_rows
+
+class Task:
+    """A unit of work in a task graph.
+    
+    func is called with the outputs of the tasks named in requires, in that
+    order, and its result is the task's output. Tasks sharing a resource
+    (e.g. writing to the warehouse) never run at the same time. retries
+    overrides the runner's number of retries for this task.
+    """
+    
+    def __init__(self, name, func, requires=(), resource=None, retries=None):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.resource = resource
+        self.retries = retries
+    
+    def __repr__(self):
+        return f"Task({self.name!r}, requires={self.requires!r})"
+
+class TaskFailed(Exception):
+    """Raised when a task still fails after all its retries."""
+    
+    def __init__(self, task_name, attempts, error):
+        super().__init__(f"Task {task_name} failed after {attempts} attempts: {error}")
+        self.task_name = task_name
+        self.error = error
+
+class InlineExecutor:
+    """Executor running each submitted call right away in the calling thread."""
+    
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+def required_tasks(tasks, targets):
+    """Names of the targets and every task they depend on, in dependency order.
+    
+    Raises ValueError for unknown tasks and dependency cycles.
+    """
+    order, visiting, visited = [], set(), set()
+    
+    def visit(name, path):
+        if name not in tasks:
+            raise ValueError(f"Unknown task {name!r} required by {path[-1] if path else 'targets'}")
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Task dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dependency in tasks[name].requires:
+            visit(dependency, path + [name])
+        visiting.discard(name)
+        visited.add(name)
+        order.append(name)
+    
+    for name in targets:
+        visit(name, [])
+    return order
+
+def run_task(task, inputs, retries, retry_delay):
+    """Run a task, retrying it with exponential backoff while it fails.
+    
+    Each attempt is measured as the step task.<name>. Returns the task's
+    output; the last error is raised as TaskFailed.
+    """
+    attempts = retries + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            with step(f"task.{task.name}") as metrics:
+                output = task.func(*inputs)
+                metrics['rows_out'] = count_rows(output)
+            return output
+        except Exception as e:
+            if attempt == attempts:
+                raise TaskFailed(task.name, attempts, e) from e
+            delay = retry_delay * 2 ** (attempt - 1)
+            logger.warning(
+                f"Task {task.name} failed (attempt {attempt} of {attempts}): {e}; "
+                f"retrying in {delay}s"
+            )
+            time.sleep(delay)
+
+def run_tasks(tasks, outputs=None, targets=None, max_workers=TASK_WORKERS,
+              retries=TASK_RETRIES, retry_delay=TASK_RETRY_DELAY):
+    """Run a graph of tasks, each as soon as the tasks it requires are done.
+    
+    Independent tasks run concurrently on a thread pool. outputs is the
+    checkpoint of task outputs by name: tasks already in it are not run
+    again, and each task's output is added as soon as it finishes, so a
+    failed run can be resumed by running the graph again with the same
+    outputs. Only targets (by default every task) and the tasks they
+    depend on are run. With max_workers=0 the tasks run one at a time in
+    the calling thread instead, e.g. so a profiler sees their work.
+    
+    A failing task is retried on its own, waiting retry_delay seconds and
+    then twice as long before each further retry, while unrelated tasks
+    carry on. Once a task runs out of retries no new task is started and
+    its TaskFailed is raised when the running tasks have finished.
+    Returns outputs.
+    """
+    tasks = {task.name: task for task in tasks}
+    outputs = {} if outputs is None else outputs
+    pending = [name for name in required_tasks(tasks, targets or tasks) if name not in outputs]
+    running, busy_resources = {}, set()
+    failure = None
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers else InlineExecutor()
+    with executor:
+        while pending or running:
+            if failure is None:
+                for name in list(pending):
+                    task = tasks[name]
+                    ready = all(dependency in outputs for dependency in task.requires)
+                    if not ready or (task.resource is not None and task.resource in busy_resources):
+                        continue
+                    pending.remove(name)
+                    if task.resource is not None:
+                        busy_resources.add(task.resource)
+                    inputs = [outputs[dependency] for dependency in task.requires]
+                    task_retries = retries if task.retries is None else task.retries
+                    future = executor.submit(run_task, task, inputs, task_retries, retry_delay)
+                    running[future] = (name, time.perf_counter())
+            if not running:
+                break
+    
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, start_time = running.pop(future)
+                busy_resources.discard(tasks[name].resource)
+                try:
+                    outputs[name] = future.result()
+                except TaskFailed as e:
+                    logger.error(str(e))
+                    failure = failure or e
+                    continue
+                logger.info(f"Finished task {name} in {time.perf_counter() - start_time:.2f}s")
+    
+    if failure is not None:
+        raise failure
+    return outputs